@@ -0,0 +1,240 @@
+"""
+Load test for the stream server, without telegram.
+
+The media sessions of the bot clients are replaced with a fake DC that serves deterministic
+bytes with a configurable latency and bandwidth. The real aiohttp app is then driven by many
+concurrent Range clients, and throughput, TTFB and p99 latencies are reported per configuration.
+
+    python -m benchmarks.stream_bench --latency 50 200 --concurrency 10 50 --clients 1 4
+
+Run it from the repository root. It only needs the packages of requirements.txt, no bot token
+or database: the settings it needs are filled with placeholders if they aren't set.
+"""
+import os
+
+for key, value in {
+    "API_ID": "1",
+    "API_HASH": "bench",
+    "BOT_TOKEN": "1:bench",
+    "LOG_CHANNEL": "-1001",
+    "DATABASE_URI": "mongodb://127.0.0.1:27017",
+    "SIGNED_LINKS": "True",
+    "STREAM_MAX_PER_USER": "0",
+}.items():
+    os.environ.setdefault(key, value)
+
+import time
+import random
+import asyncio
+import argparse
+import itertools
+from types import SimpleNamespace
+from aiohttp import web, ClientSession, TCPConnector
+from pyrogram import raw
+from pyrogram.file_id import FileId, FileType
+
+from main.bot import multi_clients, work_loads
+from database.tiered_access import tiered_access
+from main.util.signed_links import sign_copy
+from plugins import web_server
+from plugins.route import class_cache
+
+DC_ID = 4
+PATTERN_PERIOD = 251
+PATTERN = bytes(range(PATTERN_PERIOD)) * (1024 * 1024 // PATTERN_PERIOD + 2)
+
+
+def expected_bytes(offset: int, length: int) -> bytes:
+    """The bytes the fake DC serves for offset..offset+length, the file repeats 0..250."""
+    out = bytearray()
+    while length:
+        start = offset % PATTERN_PERIOD
+        part = min(length, len(PATTERN) - start)
+        out += PATTERN[start:start + part]
+        offset += part
+        length -= part
+    return bytes(out)
+
+
+class FakeSession:
+    def __init__(self, dc_id: int, file_size: int, latency: float, bandwidth: float):
+        """A media session answering upload.GetFile after latency seconds, sharing bandwidth bytes/s."""
+        self.dc_id = dc_id
+        self.file_size = file_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.free_at = 0.0
+        self.calls = 0
+
+    async def send(self, query, *args, **kwargs):
+        if isinstance(query, raw.functions.upload.GetFile):
+            length = max(min(query.limit, self.file_size - query.offset), 0)
+            now = time.monotonic()
+            self.free_at = max(self.free_at, now) + length / self.bandwidth
+            await asyncio.sleep(self.latency + self.free_at - now)
+            self.calls += 1
+            return raw.types.upload.File(
+                type=raw.types.storage.FileUnknown(),
+                mtime=0,
+                bytes=expected_bytes(query.offset, length),
+            )
+        return None
+
+    async def stop(self):
+        pass
+
+
+class FakeStorage:
+    async def dc_id(self):
+        return DC_ID
+
+    async def test_mode(self):
+        return False
+
+
+def bench_file_id() -> str:
+    return FileId(
+        file_type=FileType.DOCUMENT,
+        dc_id=DC_ID,
+        media_id=1,
+        access_hash=1,
+        file_reference=b"bench",
+    ).encode()
+
+
+class FakeClient:
+    def __init__(self, file_size: int, latency: float, bandwidth: float):
+        self.file_size = file_size
+        self.storage = FakeStorage()
+        self.media_sessions = {
+            dc_id: FakeSession(dc_id, file_size, latency, bandwidth) for dc_id in range(1, 6)
+        }
+
+    async def get_messages(self, chat_id, message_ids):
+        """The log channel message of the bench file, clients other than the first resolve it."""
+        return SimpleNamespace(
+            id=message_ids,
+            empty=False,
+            date=None,
+            document=SimpleNamespace(
+                file_id=bench_file_id(),
+                file_unique_id="bench",
+                file_size=self.file_size,
+                mime_type="video/x-matroska",
+                file_name="bench.mkv",
+            ),
+        )
+
+
+def make_token(file_size: int, user_id: int) -> str:
+    copy = {
+        "file_id": bench_file_id(),
+        "msg_id": 1,
+        "file_name": "bench.mkv",
+        "mime_type": "video/x-matroska",
+        "file_size": file_size,
+        "date": 0,
+        "unique_id": "bench",
+        "hash": "",
+    }
+    return sign_copy(copy, user_id)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+async def run_viewer(session, base_url, tokens, args, rng, results):
+    for _ in range(args.requests):
+        token = rng.choice(tokens)
+        start = rng.randrange(0, args.file_size - 1)
+        until = min(start + args.range_size, args.file_size) - 1
+        started = time.monotonic()
+        ttfb = None
+        received = bytearray()
+        try:
+            async with session.get(
+                f"{base_url}/s/{token}/bench.mkv", headers={"Range": f"bytes={start}-{until}"}
+            ) as response:
+                async for chunk in response.content.iter_any():
+                    if ttfb is None:
+                        ttfb = time.monotonic() - started
+                    received += chunk
+                status = response.status
+        except Exception:
+            results["errors"] += 1
+            continue
+        if status != 206 or bytes(received) != expected_bytes(start, until - start + 1):
+            results["errors"] += 1
+            continue
+        results["ttfb"].append(ttfb or 0.0)
+        results["latency"].append(time.monotonic() - started)
+        results["bytes"] += len(received)
+
+
+async def run_config(args, latency: float, bandwidth: float, concurrency: int, clients: int):
+    multi_clients.clear()
+    work_loads.clear()
+    class_cache.clear()
+    for index in range(clients):
+        multi_clients[index] = FakeClient(args.file_size, latency, bandwidth)
+        work_loads[index] = 0
+
+    users = list(range(1, args.users + 1))
+    for user_id in users:
+        tiered_access.user_cache.set(user_id, tiered_access.default_user_tier(user_id), ttl=24 * 60 * 60)
+    tokens = [make_token(args.file_size, user_id) for user_id in users]
+
+    runner = web.AppRunner(await web_server(), handler_cancellation=True)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    results = {"ttfb": [], "latency": [], "bytes": 0, "errors": 0}
+    rng = random.Random(args.seed)
+    started = time.monotonic()
+    try:
+        async with ClientSession(connector=TCPConnector(limit=0)) as session:
+            await asyncio.gather(*[
+                run_viewer(session, f"http://127.0.0.1:{port}", tokens, args, random.Random(rng.random()), results)
+                for _ in range(concurrency)
+            ])
+    finally:
+        await runner.cleanup()
+    elapsed = time.monotonic() - started
+    assert not results["errors"], f"{results['errors']} requests failed, the results would be meaningless"
+
+    calls = sum(s.calls for c in multi_clients.values() for s in c.media_sessions.values())
+    print(
+        f"{latency * 1000:>7.0f} {bandwidth / 1024 / 1024:>7.1f} {concurrency:>6} {clients:>7} "
+        f"{results['bytes'] / elapsed / 1024 / 1024:>9.2f} "
+        f"{percentile(results['ttfb'], 0.5) * 1000:>8.1f} {percentile(results['ttfb'], 0.99) * 1000:>8.1f} "
+        f"{percentile(results['latency'], 0.99) * 1000:>9.1f} {calls:>7} {results['errors']:>6}"
+    )
+
+
+async def main(args):
+    print(f"{'lat ms':>7} {'MiB/s':>7} {'conc':>6} {'clients':>7} {'tput MiB/s':>9} "
+          f"{'ttfb p50':>8} {'ttfb p99':>8} {'total p99':>9} {'getfile':>7} {'errors':>6}")
+    for latency, bandwidth, concurrency, clients in itertools.product(
+        args.latency, args.bandwidth, args.concurrency, args.clients
+    ):
+        await run_config(args, latency / 1000, bandwidth * 1024 * 1024, concurrency, clients)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, nargs="+", default=[50], help="GetFile latency in ms")
+    parser.add_argument("--bandwidth", type=float, nargs="+", default=[20], help="bandwidth of each fake DC session in MiB/s")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[20], help="concurrent viewers")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1], help="bot clients")
+    parser.add_argument("--users", type=int, default=20, help="distinct users the links are made for")
+    parser.add_argument("--requests", type=int, default=10, help="range requests per viewer")
+    parser.add_argument("--file-size", type=int, default=512 * 1024 * 1024)
+    parser.add_argument("--range-size", type=int, default=2 * 1024 * 1024, help="bytes asked by each range request")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
@@ -23,6 +23,11 @@ from plugins.clone import restart_bots
 from main.bot import MainBot
 from main.util.keepalive import ping_server
 from main.bot.clients import initialize_clients
+from main.util.media_sessions import warm_media_sessions, check_media_sessions
+from database.indexes import apply_indexes
+from database.filters_mdb import migrate_legacy_filters
+from database.retention import run_retention
+from database.backfill import run_backfill
 
 ppath = "plugins/*.py"
 files = glob.glob(ppath)
@@ -30,9 +35,23 @@ MainBot.start()
 loop = asyncio.get_event_loop()
 
 
+async def update_database():
+    # The backfill needs the unique index of the rollups on a standalone server,
+    # the TTL of the raw analytics events is only created once the backfill has finished.
+    if APPLY_INDEXES:
+        await asyncio.to_thread(apply_indexes)
+    if await run_backfill() and APPLY_INDEXES:
+        await asyncio.to_thread(apply_indexes, ("user_analytics",))
+
+
 async def start():
     # Initialize tiered access system
     await tiered_access.initialize()
+    await analytics_db.load_top_k()
+    asyncio.create_task(analytics_db.run_top_k_snapshots())
+    asyncio.create_task(update_database())
+    asyncio.create_task(asyncio.to_thread(migrate_legacy_filters))
+    asyncio.create_task(run_retention())
     
     print('\n')
     print('Initalizing Your Bot')
@@ -51,6 +70,9 @@ async def start():
             print("Bot Imported => " + plugin_name)
     if ON_HEROKU:
         asyncio.create_task(ping_server())
+    if STREAM_MODE and PREWARM_MEDIA_SESSIONS:
+        asyncio.create_task(warm_media_sessions())
+        asyncio.create_task(check_media_sessions())
     b_users, b_chats = await db.get_banned()
     temp.BANNED_USERS = b_users
     temp.BANNED_CHATS = b_chats
@@ -83,11 +105,13 @@ async def start():
         print("Restarting All Clone Bots.......")
         await restart_bots()
         print("Restarted All Clone Bots.")
-    app = web.AppRunner(await web_server())
+    # Cancel handlers when the client disconnects, so aborted streams stop fetching from telegram.
+    app = web.AppRunner(await web_server(), handler_cancellation=True)
     await app.setup()
     bind_address = "0.0.0.0"
     await web.TCPSite(app, bind_address, PORT).start()
     await idle()
+    await analytics_db.close()
 
 
 if __name__ == '__main__':
@@ -1,21 +1,227 @@
 import motor.motor_asyncio
-from pymongo.errors import DuplicateKeyError
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError, PyMongoError
 from database.db_helpers import get_mongo_client, get_async_mongo_client
-from info import DATABASE_NAME, OTHER_DB_URI
+from main.util.hyperloglog import HyperLogLog
+from main.util.top_k import WindowedTopK
+from main.util import metrics
+from info import DATABASE_NAME, OTHER_DB_URI, ANALYTICS_BATCH_SIZE, ANALYTICS_FLUSH_INTERVAL, ANALYTICS_MAX_BUFFER, \
+    ANALYTICS_HOURLY_RETENTION_DAYS, ANALYTICS_DAILY_RETENTION_DAYS, TOP_K_CAPACITY, TOP_K_HOURS, TOP_K_SNAPSHOT_INTERVAL
 from datetime import datetime, timedelta
+import asyncio
+import logging
 import time
 
+logger = logging.getLogger(__name__)
+
+
+ROLLUP_PERIODS = ("hour", "day")
+ROLLUP_FIELDS = ("period", "start", "dimension", "key")
+# Days a rollup is kept, by period. Each rollup gets an expires_at removed by a TTL index.
+ROLLUP_RETENTION = {"hour": ANALYTICS_HOURLY_RETENTION_DAYS, "day": ANALYTICS_DAILY_RETENTION_DAYS}
+
+
+def _period_start(timestamp, period):
+    if period == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _rollup_keys(event):
+    """
+    Yields the (period, start, dimension, key) rollups an event counts in.
+    Every event counts in its activity type and user, file and query are counted when the event has them.
+    """
+    dimensions = [("type", event["activity_type"]), ("user", event["user_id"])]
+    if event.get("file_id"):
+        dimensions.append(("file", event["file_id"]))
+    if event.get("query") and event["activity_type"] == "search":
+        dimensions.append(("query", event["query"]))
+    for period in ROLLUP_PERIODS:
+        start = _period_start(event["timestamp"], period)
+        for dimension, key in dimensions:
+            yield period, start, dimension, key
+
+def _merge(updates, key, inc, users=()):
+    update = updates.setdefault(key, {"inc": {}, "users": set()})
+    for field, value in inc.items():
+        update["inc"][field] = update["inc"].get(field, 0) + value
+    update["users"].update(users)
+
+
+class AnalyticsWriter:
+    """
+    Buffers analytics events in memory and writes them in batches.
+    A flush happens every ANALYTICS_BATCH_SIZE events or ANALYTICS_FLUSH_INTERVAL seconds and does
+    one insert_many for the events plus one bulk_write each for the merged file_stats counters and
+    the analytics_rollups counters.
+    When Mongo is slow the buffer stops at ANALYTICS_MAX_BUFFER events and new ones are dropped
+    and counted, instead of piling up tasks and memory.
+    """
+
+    def __init__(self, analytics, file_stats, rollups):
+        self.analytics = analytics
+        self.file_stats = file_stats
+        self.rollups = rollups
+        self.events = []
+        self.file_updates = {}
+        self.rollup_updates = {}
+        self.recorded = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+        self._lock = asyncio.Lock()
+        self._flusher = None
+
+    def record(self, event):
+        if len(self.events) >= ANALYTICS_MAX_BUFFER:
+            self.dropped += 1
+            return False
+        self.events.append(event)
+        self.recorded += 1
+        user_id = event["user_id"]
+        if event.get("file_id"):
+            self.count_file_access(event["file_id"], user_id, event["day"])
+        inc = {"count": 1, f"counts.{event['activity_type']}": 1}
+        for key in _rollup_keys(event):
+            _merge(self.rollup_updates, key, inc, [user_id] if key[2] == "file" else ())
+        self._schedule()
+        return True
+
+    def count_file_access(self, file_id, user_id, day):
+        _merge(self.file_updates, (file_id,), {"access_count": 1, f"daily_counts.{day}": 1}, [user_id])
+        self._schedule()
+
+    def _schedule(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_periodically())
+        if len(self.events) >= ANALYTICS_BATCH_SIZE and not self._lock.locked():
+            asyncio.create_task(self.flush())
+
+    async def _flush_periodically(self):
+        while self.events or self.file_updates or self.rollup_updates:
+            await asyncio.sleep(ANALYTICS_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def _load_sketches(self, collection, keys, fields, legacy_users=None):
+        """
+        Returns {key: HyperLogLog} of the stored users_hll of keys.
+        Users of the legacy array field, written before the sketches, are added to it.
+        """
+        projection = dict.fromkeys((*fields, "users_hll"), 1)
+        if legacy_users:
+            projection[legacy_users] = 1
+        sketches = {}
+        async for doc in collection.find({"$or": [dict(zip(fields, key)) for key in keys]}, projection):
+            sketch = HyperLogLog(doc.get("users_hll"))
+            if legacy_users:
+                sketch.update(doc.get(legacy_users) or ())
+            sketches[tuple(doc.get(field) for field in fields)] = sketch
+        return sketches
+
+    async def _write_counters(self, collection, updates, fields, on_insert=None, legacy_users=None):
+        """
+        Applies the merged counters with one bulk_write, returns the updates that must be retried.
+        Only the operations the server rejected are returned, the others were applied and
+        retrying them would count them twice. Unique users are kept in a users_hll sketch,
+        merged here with the stored one, so the document doesn't grow with the number of users.
+        legacy_users is the array of users file_stats kept before the sketches.
+        """
+        keys = list(updates)
+        try:
+            sketch_keys = [key for key in keys if updates[key]["users"]]
+            sketches = await self._load_sketches(collection, sketch_keys, fields, legacy_users) if sketch_keys else {}
+            requests = []
+            for key in keys:
+                update = updates[key]
+                document = {"$inc": update["inc"]}
+                if on_insert:
+                    document["$setOnInsert"] = on_insert(key)
+                if update["users"]:
+                    sketch = sketches.get(key) or HyperLogLog()
+                    sketch.update(update["users"])
+                    document["$set"] = {"users_hll": sketch.to_bytes()}
+                    if legacy_users:
+                        document["$unset"] = {legacy_users: ""}
+                requests.append(UpdateOne(dict(zip(fields, key)), document, upsert=True))
+            await collection.bulk_write(requests, ordered=False)
+            return {}
+        except BulkWriteError as e:
+            self.failed_flushes += 1
+            failed = {keys[error["index"]] for error in e.details.get("writeErrors", [])}
+            logger.warning(f"Couldn't update {len(failed)} counters of {collection.name}, keeping them for the next flush: {e}")
+            return {key: updates[key] for key in failed}
+        except PyMongoError as e:
+            self.failed_flushes += 1
+            logger.warning(f"Couldn't update {len(updates)} counters of {collection.name}, keeping them for the next flush: {e}")
+            return updates
+
+    async def flush(self):
+        """Writes everything buffered so far"""
+        async with self._lock:
+            events, self.events = self.events, []
+            file_updates, self.file_updates = self.file_updates, {}
+            rollup_updates, self.rollup_updates = self.rollup_updates, {}
+            if events:
+                try:
+                    await self.analytics.insert_many(events, ordered=False)
+                    self.flushed += len(events)
+                except BulkWriteError as e:
+                    # Some events were written, don't retry them.
+                    self.failed_flushes += 1
+                    self.flushed += e.details.get("nInserted", 0)
+                    self.dropped += len(events) - e.details.get("nInserted", 0)
+                    logger.warning(f"Some analytics events couldn't be written: {e}")
+                except PyMongoError as e:
+                    self.failed_flushes += 1
+                    logger.warning(f"Couldn't write {len(events)} analytics events, keeping them for the next flush: {e}")
+                    room = max(ANALYTICS_MAX_BUFFER - len(self.events), 0)
+                    self.dropped += max(len(events) - room, 0)
+                    self.events[:0] = events[:room]
+            if file_updates:
+                failed = await self._write_counters(
+                    self.file_stats, file_updates, ("file_id",), legacy_users="accessed_by"
+                )
+                for key, update in failed.items():
+                    _merge(self.file_updates, key, update["inc"], update["users"])
+            if rollup_updates:
+                failed = await self._write_counters(
+                    self.rollups, rollup_updates, ROLLUP_FIELDS,
+                    lambda key: {"expires_at": key[1] + timedelta(days=ROLLUP_RETENTION[key[0]])},
+                )
+                for key, update in failed.items():
+                    _merge(self.rollup_updates, key, update["inc"], update["users"])
+
+    def stats(self):
+        return {
+            "buffered": len(self.events),
+            "recorded": self.recorded,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "failed_flushes": self.failed_flushes,
+        }
+
+
 class Analytics:
     def __init__(self):
         self._client = get_async_mongo_client(OTHER_DB_URI)
         self.db = self._client[DATABASE_NAME]
         self.analytics = self.db.user_analytics
         self.file_stats = self.db.file_stats
+        # Hourly and daily counters per activity type, user, file and query, see _rollup_keys.
+        self.rollups = self.db.analytics_rollups
+        self.writer = AnalyticsWriter(self.analytics, self.file_stats, self.rollups)
+        # Hourly top searches, files and searches without results, in memory and snapshotted to analytics_top_k.
+        self.top_k = self.db.analytics_top_k
+        self.top = {
+            name: WindowedTopK(TOP_K_CAPACITY, windows=TOP_K_HOURS)
+            for name in ("queries", "files", "zero_results")
+        }
     
     async def track_activity(self, user_id, activity_type, file_id=None, query=None, extra_data=None):
         """
         Track a user activity in the database
         activity_type: search, file_access, premium_feature_use, etc.
+        The event is buffered and written in the next batch, see AnalyticsWriter.
         """
         timestamp = datetime.now()
         
@@ -36,28 +242,49 @@ class Analytics:
         if extra_data and isinstance(extra_data, dict):
             analytics_data.update(extra_data)
             
-        await self.analytics.insert_one(analytics_data)
-        
-        # Update file statistics if file_id is provided
-        if file_id:
-            await self.increment_file_stats(file_id, user_id)
+        # File statistics are merged and updated by the writer when file_id is provided
+        self.writer.record(analytics_data)
+        self._count_top(analytics_data)
+
+    def _count_top(self, event):
+        if event["activity_type"] == "file_access" and event.get("file_id"):
+            self.top["files"].add(event["file_id"])
+        elif event["activity_type"] == "search" and event.get("query"):
+            query = event["query"].lower().strip()
+            self.top["queries"].add(query)
+            if event.get("results") == 0:
+                self.top["zero_results"].add(query)
+
+    def get_top(self, name, hours=24, limit=10):
+        """Returns [(key, count)] of the last hours from the in-memory tracker name: queries, files or zero_results"""
+        return self.top[name].top(limit, hours=hours)
+
+    async def load_top_k(self):
+        """Restores the trackers from their last snapshot"""
+        async for document in self.top_k.find({"_id": {"$in": list(self.top)}}):
+            self.top[document["_id"]].load_document(document)
+
+    async def save_top_k(self):
+        for name, tracker in self.top.items():
+            await self.top_k.replace_one({"_id": name}, tracker.to_document(), upsert=True)
+
+    async def run_top_k_snapshots(self):
+        while True:
+            await asyncio.sleep(TOP_K_SNAPSHOT_INTERVAL)
+            try:
+                await self.save_top_k()
+            except PyMongoError as e:
+                logger.warning(f"Couldn't save the top searches and files: {e}")
+
+    async def close(self):
+        """Writes the buffered events and the trackers, call it before the bot exits"""
+        await self.writer.flush()
+        await self.save_top_k()
     
     async def increment_file_stats(self, file_id, user_id):
-        """Increment access count for a file"""
+        """Increment access count for a file, written with the next batch"""
         today = datetime.now().strftime("%Y-%m-%d")
-        
-        # Use upsert to create the document if it doesn't exist
-        await self.file_stats.update_one(
-            {"file_id": file_id},
-            {
-                "$inc": {
-                    "access_count": 1,
-                    f"daily_counts.{today}": 1
-                },
-                "$addToSet": {"accessed_by": user_id}
-            },
-            upsert=True
-        )
+        self.writer.count_file_access(file_id, user_id, today)
 
     async def get_user_activity(self, user_id, days=7):
         """Get activity statistics for a specific user"""
@@ -127,30 +354,27 @@ class Analytics:
             "daily_activity": activity_by_day
         }
 
+    def _rollup_match(self, dimension, days, period="day", until=None):
+        """
+        Matches the rollups of exactly days, in whole periods, the last one being the period of until (now).
+        Hourly and daily windows of the same days cover the same hours.
+        """
+        step = timedelta(hours=1) if period == "hour" else timedelta(days=1)
+        end = _period_start(until or datetime.now(), period) + step
+        return {"period": period, "dimension": dimension, "start": {"$gte": end - timedelta(days=days), "$lt": end}}
+
     async def get_most_active_users(self, days=7, limit=10):
         """Get the most active users in the specified time period"""
-        cutoff_date = datetime.now() - timedelta(days=days)
-        
         pipeline = [
             {
-                "$match": {
-                    "timestamp": {"$gt": cutoff_date}
-                }
+                "$match": self._rollup_match("user", days)
             },
             {
                 "$group": {
-                    "_id": "$user_id",
-                    "total_activity": {"$sum": 1},
-                    "searches": {
-                        "$sum": {
-                            "$cond": [{"$eq": ["$activity_type", "search"]}, 1, 0]
-                        }
-                    },
-                    "file_accesses": {
-                        "$sum": {
-                            "$cond": [{"$eq": ["$activity_type", "file_access"]}, 1, 0]
-                        }
-                    }
+                    "_id": "$key",
+                    "total_activity": {"$sum": "$count"},
+                    "searches": {"$sum": "$counts.search"},
+                    "file_accesses": {"$sum": "$counts.file_access"}
                 }
             },
             {
@@ -161,32 +385,32 @@ class Analytics:
             }
         ]
         
-        return await self.analytics.aggregate(pipeline).to_list(length=limit)
+        return await self.rollups.aggregate(pipeline).to_list(length=limit)
         
-    async def get_most_accessed_files(self, days=7, limit=10):
-        """Get the most accessed files in the specified time period"""
-        cutoff_date = datetime.now() - timedelta(days=days)
+    async def get_most_accessed_files(self, days=7, limit=10, until=None):
+        """
+        Get the most accessed files in the specified time period.
+        With until, the period is the days ending with it instead of the last days.
+        """
+        match = self._rollup_match("file", days, until=until)
+        match["counts.file_access"] = {"$gt": 0}
         
-        # Query to get files with most accesses
         pipeline = [
             {
-                "$match": {
-                    "activity_type": "file_access",
-                    "timestamp": {"$gt": cutoff_date}
-                }
+                "$match": match
             },
             {
                 "$group": {
-                    "_id": "$file_id",
-                    "access_count": {"$sum": 1},
-                    "unique_users": {"$addToSet": "$user_id"}
+                    "_id": "$key",
+                    "access_count": {"$sum": "$counts.file_access"},
+                    "users_hll": {"$push": "$users_hll"}
                 }
             },
             {
                 "$project": {
                     "file_id": "$_id",
                     "access_count": 1,
-                    "unique_user_count": {"$size": "$unique_users"}
+                    "users_hll": 1
                 }
             },
             {
@@ -197,24 +421,39 @@ class Analytics:
             }
         ]
         
-        return await self.analytics.aggregate(pipeline).to_list(length=limit)
+        files = await self.rollups.aggregate(pipeline).to_list(length=limit)
+        for file in files:
+            # Unique users of the period, merged from the sketches of each day
+            file["unique_user_count"] = HyperLogLog.union(file.pop("users_hll")).count()
+        return files
     
+    async def get_file_access_trend(self, days=3, limit=50):
+        """
+        Returns the limit most accessed files of the last days as [{file_id, access_count}]
+        and {file_id: access_count} of the days before them. Counted in memory when the
+        file tracker keeps both periods, from the daily rollups otherwise.
+        """
+        files = self.top["files"]
+        if files.covers(2 * days * 24):
+            now = time.time()
+            current = files.counts(now - days * 86400)
+            previous = files.counts(now - 2 * days * 86400, now - days * 86400)
+            ranked = sorted(current.items(), key=lambda item: item[1], reverse=True)[:limit]
+            return [{"file_id": file_id, "access_count": count} for file_id, count in ranked], previous
+        current = await self.get_most_accessed_files(days=days, limit=limit)
+        previous = await self.get_most_accessed_files(days=days, limit=limit, until=datetime.now() - timedelta(days=days))
+        return current, {item["file_id"]: item["access_count"] for item in previous}
+
     async def get_popular_search_terms(self, days=7, limit=10):
         """Get the most popular search terms"""
-        cutoff_date = datetime.now() - timedelta(days=days)
-        
         pipeline = [
             {
-                "$match": {
-                    "activity_type": "search",
-                    "timestamp": {"$gt": cutoff_date},
-                    "query": {"$exists": True}
-                }
+                "$match": self._rollup_match("query", days)
             },
             {
                 "$group": {
-                    "_id": "$query",
-                    "count": {"$sum": 1}
+                    "_id": "$key",
+                    "count": {"$sum": "$count"}
                 }
             },
             {
@@ -225,35 +464,20 @@ class Analytics:
             }
         ]
         
-        return await self.analytics.aggregate(pipeline).to_list(length=limit)
+        return await self.rollups.aggregate(pipeline).to_list(length=limit)
         
     async def get_hourly_usage_stats(self, days=1):
-        """Get hourly usage statistics for the last day"""
-        cutoff_date = datetime.now() - timedelta(days=days)
-        
-        pipeline = [
-            {
-                "$match": {
-                    "timestamp": {"$gt": cutoff_date}
-                }
-            },
-            {
-                "$group": {
-                    "_id": "$hour",
-                    "count": {"$sum": 1}
-                }
-            },
-            {
-                "$sort": {"_id": 1}
-            }
-        ]
-        
-        hourly_stats = await self.analytics.aggregate(pipeline).to_list(length=24)
-        
+        """
+        Get hourly usage statistics for the last days, by hour of the day.
+        Exactly days * 24 hours are counted, the current one included, so every hour of the day sums days hours.
+        """
+        # One rollup per activity type and hour
+        rollups = self.rollups.find(self._rollup_match("type", days, period="hour"), {"start": 1, "count": 1})
+
         # Format the results as a list of 24 hours
         result = [0] * 24
-        for stat in hourly_stats:
-            result[stat["_id"]] = stat["count"]
+        async for rollup in rollups:
+            result[rollup["start"].hour] += rollup["count"]
             
         return result
 
@@ -292,4 +516,21 @@ class Analytics:
         
         return await self.analytics.aggregate(pipeline).to_list(length=limit)
 
-analytics_db = Analytics() 
\ No newline at end of file
+analytics_db = Analytics()
+
+@metrics.register_collector
+def _writer_metrics():
+    writer = analytics_db.writer.stats()
+    lines = [
+        "# HELP bot_analytics_events_buffered Analytics events waiting for the next flush.",
+        "# TYPE bot_analytics_events_buffered gauge",
+        f"bot_analytics_events_buffered {writer['buffered']}",
+        "# HELP bot_analytics_events_total Analytics events by outcome.",
+        "# TYPE bot_analytics_events_total counter",
+    ]
+    for outcome in ("recorded", "flushed", "dropped"):
+        lines.append(f'bot_analytics_events_total{{outcome="{outcome}"}} {writer[outcome]}')
+    lines.append("# HELP bot_analytics_failed_flushes_total Analytics flushes the database rejected.")
+    lines.append("# TYPE bot_analytics_failed_flushes_total counter")
+    lines.append(f"bot_analytics_failed_flushes_total {writer['failed_flushes']}")
+    return lines
@@ -0,0 +1,202 @@
+"""
+One-off backfill of analytics_rollups from the raw user_analytics events written before the rollups
+existed. Events are rolled up in batches by _id and a watermark is saved after each batch, so the
+backfill can be stopped and resumed without counting an event twice. On a replica set the batch and
+the watermark are written in one transaction. A standalone server has no transactions, there every
+rollup is stamped with the batch that last counted in it, so a batch written again skips them:
+
+    python -m database.backfill
+
+Raw events expire through the TTL index of user_analytics, apply_indexes only creates it once the
+backfill has finished. file_stats was already counted before the rollups, it needs no backfill.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+from info import DATABASE_NAME, OTHER_DB_URI
+from database.db_helpers import get_mongo_client
+from database.analytics import ROLLUP_PERIODS, ROLLUP_FIELDS, ROLLUP_RETENTION, _rollup_keys, _merge
+from main.util.hyperloglog import HyperLogLog
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_ID = "analytics_rollups"
+ROLLUPS_UNIQUE_INDEX = "dimension_1_period_1_start_1_key_1"
+
+
+def _database():
+    return get_mongo_client(OTHER_DB_URI)[DATABASE_NAME]
+
+def _cutoff(rollups):
+    """
+    Returns the time the live rollups start from, the events before it were never rolled up.
+    That is the first hourly rollup, or the first whole day once the hourly rollups of the
+    first day expired. Without any rollup every event written so far is backfilled.
+    """
+    first = {}
+    for period in ROLLUP_PERIODS:
+        rollup = rollups.find_one({"dimension": "type", "period": period}, {"start": 1}, sort=[("start", 1)])
+        first[period] = rollup["start"] if rollup else None
+    if first["hour"] and (first["day"] is None or first["hour"] < first["day"] + timedelta(days=1)):
+        return first["hour"]
+    return first["day"] or datetime.now()
+
+def _supports_transactions(client):
+    hello = client.admin.command("hello")
+    return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+def _watermark(database):
+    backfills = database.analytics_backfill
+    watermark = backfills.find_one({"_id": WATERMARK_ID})
+    if watermark is None:
+        watermark = {
+            "_id": WATERMARK_ID,
+            "cutoff": _cutoff(database.analytics_rollups),
+            "last_id": None,
+            "events": 0,
+            "finished": False,
+        }
+        try:
+            backfills.insert_one(watermark)
+        except DuplicateKeyError:
+            watermark = backfills.find_one({"_id": WATERMARK_ID})
+    return watermark
+
+def rollups_backfilled(database=None):
+    """True once backfill_rollups went through every event written before the rollups"""
+    database = database if database is not None else _database()
+    watermark = database.analytics_backfill.find_one({"_id": WATERMARK_ID}, {"finished": 1})
+    return bool(watermark and watermark.get("finished"))
+
+
+def _rollup_updates(events, now):
+    """Merges the rollup counters of events, rollups that would already be expired are skipped."""
+    updates = {}
+    for event in events:
+        if not event.get("activity_type") or "user_id" not in event or not isinstance(event.get("timestamp"), datetime):
+            continue
+        inc = {"count": 1, f"counts.{event['activity_type']}": 1}
+        for key in _rollup_keys(event):
+            if key[1] + timedelta(days=ROLLUP_RETENTION[key[0]]) > now:
+                _merge(updates, key, inc, [event["user_id"]] if key[2] == "file" else ())
+    return updates
+
+def _write_rollups(rollups, updates, session=None, batch=None):
+    """
+    Same writes as AnalyticsWriter._write_counters, in the backfill's transaction.
+    Without one, batch stamps the rollups it counted in, the unique index makes the upsert of a
+    rollup already stamped with it fail, and those failures are the writes to skip.
+    """
+    keys = [key for key, update in updates.items() if update["users"]]
+    sketches = {}
+    if keys:
+        projection = dict.fromkeys((*ROLLUP_FIELDS, "users_hll"), 1)
+        for rollup in rollups.find({"$or": [dict(zip(ROLLUP_FIELDS, key)) for key in keys]}, projection, session=session):
+            sketches[tuple(rollup.get(field) for field in ROLLUP_FIELDS)] = HyperLogLog(rollup.get("users_hll"))
+    requests = []
+    for key, update in updates.items():
+        document = {
+            "$inc": update["inc"],
+            "$setOnInsert": {"expires_at": key[1] + timedelta(days=ROLLUP_RETENTION[key[0]])},
+        }
+        query = dict(zip(ROLLUP_FIELDS, key))
+        if batch is not None:
+            query["backfill_batch"] = {"$ne": batch}
+            document["$set"] = {"backfill_batch": batch}
+        if update["users"]:
+            sketch = sketches.get(key) or HyperLogLog()
+            sketch.update(update["users"])
+            document.setdefault("$set", {})["users_hll"] = sketch.to_bytes()
+        requests.append(UpdateOne(query, document, upsert=True))
+    if not requests:
+        return
+    try:
+        rollups.bulk_write(requests, ordered=False, session=session)
+    except BulkWriteError as e:
+        if batch is None or any(error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+
+def backfill_rollups(batch_size=1000):
+    """
+    Rolls up the events older than the live rollups, from the watermark on. Returns the events rolled up.
+    Batches are written in transactions on a replica set, which every MongoDB Atlas cluster is,
+    and are stamped on a standalone server, which needs the unique index of the rollups.
+    """
+    database = _database()
+    watermark = _watermark(database)
+    if watermark["finished"]:
+        return 0
+    transactions = _supports_transactions(database.client)
+    if not transactions and ROLLUPS_UNIQUE_INDEX not in database.analytics_rollups.index_information():
+        logger.error(
+            "The rollups backfill needs transactions or the unique index of analytics_rollups, run "
+            "python -m database.indexes. Raw analytics events won't expire until the backfill finishes."
+        )
+        return 0
+    done = 0
+    while True:
+        query = {"timestamp": {"$lt": watermark["cutoff"]}}
+        if watermark["last_id"] is not None:
+            query["_id"] = {"$gt": watermark["last_id"]}
+        events = list(database.user_analytics.find(query).sort("_id", 1).limit(batch_size))
+        if not events:
+            break
+        updates = _rollup_updates(events, datetime.now())
+        batch = events[-1]["_id"]
+        if not transactions:
+            _write_rollups(database.analytics_rollups, updates, batch=batch)
+            moved = database.analytics_backfill.update_one(
+                {"_id": WATERMARK_ID, "last_id": watermark["last_id"]},
+                {"$set": {"last_id": batch}, "$inc": {"events": len(events)}},
+            )
+            if not moved.matched_count:
+                logger.warning("Another run moved the rollups backfill watermark, leaving it the rest")
+                return done
+            watermark["last_id"] = batch
+            done += len(events)
+            continue
+
+        def apply(session):
+            # Moving the watermark first makes a concurrent run of the same batch write nothing.
+            moved = database.analytics_backfill.update_one(
+                {"_id": WATERMARK_ID, "last_id": watermark["last_id"]},
+                {"$set": {"last_id": events[-1]["_id"]}, "$inc": {"events": len(events)}},
+                session=session,
+            )
+            if moved.matched_count:
+                _write_rollups(database.analytics_rollups, updates, session)
+            return bool(moved.matched_count)
+
+        with database.client.start_session() as session:
+            if not session.with_transaction(apply):
+                logger.warning("Another run moved the rollups backfill watermark, leaving it the rest")
+                return done
+        watermark["last_id"] = events[-1]["_id"]
+        done += len(events)
+    database.analytics_backfill.update_one(
+        {"_id": WATERMARK_ID}, {"$set": {"finished": True, "finished_at": datetime.now()}}
+    )
+    logger.info(f"Analytics rollups backfilled, {watermark['events'] + done} events before {watermark['cutoff']}")
+    return done
+
+async def run_backfill():
+    """
+    Runs backfill_rollups in a thread, a failed run resumes from its watermark at the next start.
+    Returns True when the backfill has finished.
+    """
+    try:
+        await asyncio.to_thread(backfill_rollups)
+        return await asyncio.to_thread(rollups_backfilled)
+    except PyMongoError as e:
+        logger.error(
+            f"Analytics rollups backfill stopped, it resumes at the next start. "
+            f"Raw analytics events won't expire until it finishes: {e}"
+        )
+        return False
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(f"Rolled up {backfill_rollups()} events")
@@ -1,35 +1,139 @@
-# Clone Bot
-
 from pymongo import MongoClient
+from pymongo.monitoring import ConnectionPoolListener
+from info import MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_TIME_MS, MONGO_COMPRESSORS
 import motor.motor_asyncio
+import threading
 import ssl
+from main.util import metrics
+
+# One sync and one async client per URI, shared by every module of the bot.
+# Clients don't open any connection until their first operation.
+_sync_clients = {}
+_async_clients = {}
+_pool_listeners = {}
+_lock = threading.Lock()
+
+
+class PoolStats(ConnectionPoolListener):
+    """Counts the connection pool events of the clients of one URI."""
+
+    def __init__(self):
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checked_in = 0
+        self.checkout_failed = 0
+        self.pools_cleared = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self.pools_cleared += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.closed += 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self.checkout_failed += 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        self.checked_in += 1
+
+    def as_dict(self):
+        return {
+            "open": self.created - self.closed,
+            "in_use": self.checked_out - self.checked_in,
+            "created": self.created,
+            "closed": self.closed,
+            "checkout_failed": self.checkout_failed,
+            "pools_cleared": self.pools_cleared,
+        }
+
+
+def _client_options(uri):
+    listener = _pool_listeners.setdefault(uri, PoolStats())
+    options = dict(
+        tls=True,
+        tlsAllowInvalidCertificates=True,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        event_listeners=[listener],
+    )
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return options
 
 def get_mongo_client(uri):
     """
-    Create a MongoDB client with proper TLS/SSL settings.
+    Returns the shared MongoDB client for uri, with proper TLS/SSL settings.
     This resolves the SSL handshake failures with MongoDB Atlas.
     """
     if not uri:
         return None
-    
-    # Connect with modern TLS/SSL options
-    return MongoClient(
-        uri,
-        tls=True,
-        tlsAllowInvalidCertificates=True
-    )
+
+    with _lock:
+        if uri not in _sync_clients:
+            # Connect with modern TLS/SSL options
+            _sync_clients[uri] = MongoClient(uri, connect=False, **_client_options(uri))
+        return _sync_clients[uri]
 
 def get_async_mongo_client(uri):
     """
-    Create an asynchronous MongoDB client with proper TLS/SSL settings.
+    Returns the shared asynchronous MongoDB client for uri, with proper TLS/SSL settings.
     For Motor AsyncIOMotorClient connections.
     """
     if not uri:
         return None
-    
-    # Connect with modern TLS/SSL options
-    return motor.motor_asyncio.AsyncIOMotorClient(
-        uri,
-        tls=True,
-        tlsAllowInvalidCertificates=True
-    ) 
\ No newline at end of file
+
+    with _lock:
+        if uri not in _async_clients:
+            # Connect with modern TLS/SSL options
+            _async_clients[uri] = motor.motor_asyncio.AsyncIOMotorClient(uri, **_client_options(uri))
+        return _async_clients[uri]
+
+def get_pool_stats():
+    """
+    Returns the connection pool stats of every URI in use, by pool number.
+    Pools are numbered in the order their URI was first used, so hosts and credentials aren't exposed.
+    """
+    stats = {}
+    for number, (uri, listener) in enumerate(_pool_listeners.items()):
+        clients = int(uri in _sync_clients) + int(uri in _async_clients)
+        stats[str(number)] = dict(listener.as_dict(), clients=clients)
+    return stats
+
+@metrics.register_collector
+def _pool_metrics():
+    pool_stats = get_pool_stats()
+    lines = [
+        "# HELP mongo_pool_connections Connections of the shared MongoDB clients by pool and state.",
+        "# TYPE mongo_pool_connections gauge",
+    ]
+    for pool, stats in pool_stats.items():
+        lines.append(f'mongo_pool_connections{{pool="{pool}",state="open"}} {stats["open"]}')
+        lines.append(f'mongo_pool_connections{{pool="{pool}",state="in_use"}} {stats["in_use"]}')
+    lines.append("# HELP mongo_pool_checkout_failed_total Failed connection checkouts by pool.")
+    lines.append("# TYPE mongo_pool_checkout_failed_total counter")
+    for pool, stats in pool_stats.items():
+        lines.append(f'mongo_pool_checkout_failed_total{{pool="{pool}"}} {stats["checkout_failed"]}')
+    return lines
@@ -1,11 +1,17 @@
 # Clone Bot
 
+import re
+import sys
 import pymongo
 import os
+import threading
 from info import OTHER_DB_URI, DATABASE_NAME
 from pyrogram import enums
 import logging
+from pymongo import UpdateOne
 from database.db_helpers import get_mongo_client
+from main.util.cache import TTLCache
+from main.util.keyword_matcher import KeywordMatcher
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.ERROR)
@@ -13,13 +19,93 @@ logger.setLevel(logging.ERROR)
 myclient = get_mongo_client(OTHER_DB_URI)
 mydb = myclient[DATABASE_NAME]
 
+# Every group's filters live in this collection, indexed on (group_id, text).
+# Older versions used one collection per group named after the group id, those are
+# migrated the first time the group is used or by migrate_legacy_filters.
+filtcol = mydb["manual_filters"]
+# Listed on first use, not at import. The startup migration thread and the handlers both
+# migrate, so each group has a lock and is checked again once it is held.
+_legacy_groups = None
+_legacy_lock = threading.Lock()
+_group_locks = {}
+
+# group id -> (KeywordMatcher, {keyword: (reply_text, btn, alert, fileid)}), kept in sync by every write below.
+filter_cache = TTLCache(maxsize=2000)
+
+
+def _legacy():
+    """Returns the ids of the groups that still have a legacy collection"""
+    global _legacy_groups
+    if _legacy_groups is None:
+        with _legacy_lock:
+            if _legacy_groups is None:
+                _legacy_groups = {name for name in mydb.list_collection_names() if re.fullmatch(r"-?\d+", name)}
+    return _legacy_groups
+
+def _migrate_group(group_id):
+    """Moves the filters of a legacy per-group collection into manual_filters"""
+    with _legacy_lock:
+        lock = _group_locks.setdefault(group_id, threading.Lock())
+    with lock:
+        if group_id not in _legacy():
+            # Migrated by another thread while this one waited for the lock.
+            return 0
+        legacy = mydb[group_id]
+        ops = []
+        for file in legacy.find():
+            file.pop('_id', None)
+            file['group_id'] = group_id
+            # A filter saved since the migration started wins over the legacy one.
+            ops.append(UpdateOne({'group_id': group_id, 'text': file['text']}, {"$setOnInsert": file}, upsert=True))
+        if ops:
+            filtcol.bulk_write(ops, ordered=False)
+        legacy.drop()
+        with _legacy_lock:
+            _legacy_groups.discard(group_id)
+            _group_locks.pop(group_id, None)
+    return len(ops)
+
+def _group(group_id):
+    group_id = str(group_id)
+    if group_id in _legacy():
+        _migrate_group(group_id)
+    return group_id
+
+def migrate_legacy_filters():
+    """Migrates every legacy per-group collection, returns (groups, filters) migrated"""
+    groups = filters = 0
+    for group_id in list(_legacy()):
+        try:
+            filters += _migrate_group(group_id)
+            groups += 1
+        except pymongo.errors.PyMongoError:
+            logger.exception(f"Couldn't migrate the filters of {group_id}", exc_info=True)
+    if groups:
+        logger.info(f"Migrated {filters} filters of {groups} groups to manual_filters")
+    return groups, filters
+
+
+def _filter_body(file):
+    return file['reply'], file['btn'], file.get('alert'), file['file']
+
+def _load_group(group_id):
+    group_id = _group(group_id)
+    cached = filter_cache.get(group_id)
+    if cached is None:
+        bodies = {}
+        for file in filtcol.find({'group_id': group_id}):
+            bodies[file['text']] = _filter_body(file)
+        cached = (KeywordMatcher(bodies), bodies)
+        filter_cache.set(group_id, cached)
+    return cached
+
 
 
 async def add_filter(grp_id, text, reply_text, btn, file, alert):
-    mycol = mydb[str(grp_id)]
-    # mycol.create_index([('text', 'text')])
+    group_id = _group(grp_id)
 
     data = {
+        'group_id':group_id,
         'text':str(text),
         'reply':str(reply_text),
         'btn':str(btn),
@@ -28,35 +114,39 @@ async def add_filter(grp_id, text, reply_text, btn, file, alert):
     }
 
     try:
-        mycol.update_one({'text': str(text)},  {"$set": data}, upsert=True)
+        filtcol.update_one({'group_id': group_id, 'text': str(text)},  {"$set": data}, upsert=True)
     except:
         logger.exception('Some error occured!', exc_info=True)
-             
-     
+        return
+    cached = filter_cache.get(group_id)
+    if cached is not None:
+        matcher, bodies = cached
+        matcher.add(data['text'])
+        bodies[data['text']] = _filter_body(data)
+
+
 async def find_filter(group_id, name):
-    mycol = mydb[str(group_id)]
-    
-    query = mycol.find( {"text":name})
-    # query = mycol.find( { "$text": {"$search": name}})
-    try:
-        for file in query:
-            reply_text = file['reply']
-            btn = file['btn']
-            fileid = file['file']
-            try:
-                alert = file['alert']
-            except:
-                alert = None
-        return reply_text, btn, alert, fileid
-    except:
+    file = filtcol.find_one({'group_id': _group(group_id), 'text': name})
+    if not file:
         return None, None, None, None
+    return file['reply'], file['btn'], file.get('alert'), file['file']
 
 
-async def get_filters(group_id):
-    mycol = mydb[str(group_id)]
+async def match_filter(group_id, text):
+    """
+    Returns (keyword, reply_text, btn, alert, fileid) of the longest filter of the group found in text,
+    or None. The group's filters are loaded once and matched in a single pass over the text.
+    """
+    matcher, bodies = _load_group(group_id)
+    keyword = matcher.longest_match(text)
+    if keyword is None:
+        return None
+    return (keyword, *bodies[keyword])
+
 
+async def get_filters(group_id):
     texts = []
-    query = mycol.find()
+    query = filtcol.find({'group_id': _group(group_id)}, {'text': 1})
     try:
         for file in query:
             text = file['text']
@@ -67,12 +157,16 @@ async def get_filters(group_id):
 
 
 async def delete_filter(message, text, group_id):
-    mycol = mydb[str(group_id)]
-    
-    myquery = {'text':text }
-    query = mycol.count_documents(myquery)
+    group_id = _group(group_id)
+
+    myquery = {'group_id': group_id, 'text':text }
+    query = filtcol.delete_one(myquery).deleted_count
     if query == 1:
-        mycol.delete_one(myquery)
+        cached = filter_cache.get(group_id)
+        if cached is not None:
+            matcher, bodies = cached
+            matcher.remove(text)
+            bodies.pop(text, None)
         await message.reply_text(
             f"'`{text}`'  deleted. I'll not respond to that filter anymore.",
             quote=True,
@@ -83,38 +177,43 @@ async def delete_filter(message, text, group_id):
 
 
 async def del_all(message, group_id, title):
-    if str(group_id) not in mydb.list_collection_names():
-        await message.edit_text(f"Nothing to remove in {title}!")
-        return
-
-    mycol = mydb[str(group_id)]
+    group_id = _group(group_id)
     try:
-        mycol.drop()
-        await message.edit_text(f"All filters from {title} has been removed")
+        deleted = filtcol.delete_many({'group_id': group_id}).deleted_count
     except:
         await message.edit_text("Couldn't remove all filters from group!")
         return
+    filter_cache.pop(group_id)
+    if not deleted:
+        await message.edit_text(f"Nothing to remove in {title}!")
+        return
+    await message.edit_text(f"All filters from {title} has been removed")
 
 
 async def count_filters(group_id):
-    mycol = mydb[str(group_id)]
-
-    count = mycol.count()
+    count = filtcol.count_documents({'group_id': _group(group_id)})
     return False if count == 0 else count
 
 
 async def filter_stats():
-    collections = mydb.list_collection_names()
-
-    if "CONNECTION" in collections:
-        collections.remove("CONNECTION")
-
-    totalcount = 0
-    for collection in collections:
-        mycol = mydb[collection]
-        count = mycol.count()
-        totalcount += count
-
-    totalcollections = len(collections)
-
-    return totalcollections, totalcount
+    """
+    Returns the number of groups with filters and the number of filters.
+    Legacy groups are counted once the startup migration has moved them.
+    """
+    result = list(filtcol.aggregate([
+        {"$group": {"_id": "$group_id", "count": {"$sum": 1}}},
+        {"$group": {"_id": None, "groups": {"$sum": 1}, "filters": {"$sum": "$count"}}},
+    ]))
+    if not result:
+        return 0, 0
+    return result[0]['groups'], result[0]['filters']
+
+
+if __name__ == "__main__":
+    # python -m database.filters_mdb migrate
+    logging.basicConfig(level=logging.INFO)
+    logger.setLevel(logging.INFO)
+    if sys.argv[1:] == ["migrate"]:
+        print("Migrated {} groups, {} filters".format(*migrate_legacy_filters()))
+    else:
+        print("usage: python -m database.filters_mdb migrate")
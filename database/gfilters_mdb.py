@@ -7,6 +7,7 @@ from info import OTHER_DB_URI, DATABASE_NAME
 from pyrogram import enums
 import logging
 from database.db_helpers import get_mongo_client
+from main.util.keyword_matcher import KeywordMatcher
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.ERROR)
@@ -14,6 +15,25 @@ logger.setLevel(logging.ERROR)
 myclient = get_mongo_client(OTHER_DB_URI)
 mydb = myclient[DATABASE_NAME]
 
+# Global filters are the same in every group, so they are matched by one process-wide
+# matcher per collection: name -> (KeywordMatcher, {keyword: (reply_text, btn, alert, fileid)}).
+# It is loaded on first use and kept in sync by add_gfilter, delete_gfilter and del_allg.
+gfilter_matchers = {}
+
+
+def _gfilter_body(file):
+    return file['reply'], file['btn'], file.get('alert'), file['file']
+
+def _load_gfilters(gfilters):
+    loaded = gfilter_matchers.get(str(gfilters))
+    if loaded is None:
+        bodies = {}
+        for file in mydb[str(gfilters)].find():
+            bodies[file['text']] = _gfilter_body(file)
+        loaded = (KeywordMatcher(bodies), bodies)
+        gfilter_matchers[str(gfilters)] = loaded
+    return loaded
+
 
 
 async def add_gfilter(gfilters, text, reply_text, btn, file, alert):
@@ -32,6 +52,12 @@ async def add_gfilter(gfilters, text, reply_text, btn, file, alert):
         mycol.update_one({'text': str(text)},  {"$set": data}, upsert=True)
     except:
         logger.exception('Some error occured!', exc_info=True)
+        return
+    loaded = gfilter_matchers.get(str(gfilters))
+    if loaded is not None:
+        matcher, bodies = loaded
+        matcher.add(data['text'])
+        bodies[data['text']] = _gfilter_body(data)
              
      
 async def find_gfilter(gfilters, name):
@@ -53,6 +79,15 @@ async def find_gfilter(gfilters, name):
         return None, None, None, None
 
 
+async def match_gfilter(gfilters, text):
+    """Returns (keyword, reply_text, btn, alert, fileid) of the longest global filter found in text, or None."""
+    matcher, bodies = _load_gfilters(gfilters)
+    keyword = matcher.longest_match(text)
+    if keyword is None:
+        return None
+    return (keyword, *bodies[keyword])
+
+
 async def get_gfilters(gfilters):
     mycol = mydb[str(gfilters)]
 
@@ -74,6 +109,11 @@ async def delete_gfilter(message, text, gfilters):
     query = mycol.count_documents(myquery)
     if query == 1:
         mycol.delete_one(myquery)
+        loaded = gfilter_matchers.get(str(gfilters))
+        if loaded is not None:
+            matcher, bodies = loaded
+            matcher.remove(text)
+            bodies.pop(text, None)
         await message.reply_text(
             f"'`{text}`'  deleted. I'll not respond to that gfilter anymore.",
             quote=True,
@@ -90,6 +130,7 @@ async def del_allg(message, gfilters):
     mycol = mydb[str(gfilters)]
     try:
         mycol.drop()
+        gfilter_matchers.pop(str(gfilters), None)
         await message.edit_text(f"All gfilters has been removed !")
     except:
         await message.edit_text("Couldn't remove all gfilters !")
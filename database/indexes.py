@@ -0,0 +1,173 @@
+"""
+Every index the bot relies on, applied idempotently at startup (APPLY_INDEXES) or from the command line:
+
+    python -m database.indexes            # create the missing indexes
+    python -m database.indexes --report   # show missing and unused indexes, from $indexStats
+"""
+import sys
+import logging
+from pymongo import IndexModel, ASCENDING, DESCENDING, TEXT
+from pymongo.errors import OperationFailure, PyMongoError
+from info import DATABASE_NAME, COLLECTION_NAME, USER_DB_URI, OTHER_DB_URI, FILE_DB_URI, SEC_FILE_DB_URI, MULTIPLE_DATABASE, \
+    ANALYTICS_RETENTION_DAYS, DUPLICATES_RETENTION_DAYS, NLP_CACHE_TTL
+from database.db_helpers import get_mongo_client
+from database.backfill import rollups_backfilled
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+
+# (database url, database name, collection, indexes)
+# expireAfterSeconds of the TTL indexes follows the retention settings, see _sync_options.
+MANIFEST = [
+    (USER_DB_URI, DATABASE_NAME, "users", [IndexModel([("id", ASCENDING)])]),
+    (USER_DB_URI, DATABASE_NAME, "groups", [IndexModel([("id", ASCENDING)])]),
+    (USER_DB_URI, DATABASE_NAME, "uersz", [IndexModel([("id", ASCENDING)])]),
+    (USER_DB_URI, DATABASE_NAME, "clone_bots", [
+        IndexModel([("user_id", ASCENDING)]),
+        IndexModel([("bot_id", ASCENDING)]),
+    ]),
+    (OTHER_DB_URI, DATABASE_NAME, "file_stats", [IndexModel([("file_id", ASCENDING)])]),
+    (OTHER_DB_URI, DATABASE_NAME, "user_analytics", [
+        IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING)]),
+        IndexModel([("activity_type", ASCENDING), ("timestamp", DESCENDING)]),
+        IndexModel([("timestamp", ASCENDING)], expireAfterSeconds=ANALYTICS_RETENTION_DAYS * DAY),
+    ]),
+    (OTHER_DB_URI, DATABASE_NAME, "analytics_rollups", [
+        IndexModel([("dimension", ASCENDING), ("period", ASCENDING), ("start", ASCENDING), ("key", ASCENDING)], unique=True),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ]),
+    (OTHER_DB_URI, DATABASE_NAME, "user_tiers", [IndexModel([("user_id", ASCENDING)], unique=True)]),
+    (OTHER_DB_URI, DATABASE_NAME, "tier_usage", [IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0)]),
+    (OTHER_DB_URI, DATABASE_NAME, "tier_config", [IndexModel([("tier_name", ASCENDING)])]),
+    (OTHER_DB_URI, DATABASE_NAME, "log_copies", [IndexModel([("msg_id", ASCENDING)])]),
+    (OTHER_DB_URI, DATABASE_NAME, "detected_duplicates", [
+        IndexModel([("duplicate_id", ASCENDING)]),
+        IndexModel([("status", ASCENDING)]),
+        IndexModel(
+            [("resolved_at", ASCENDING)],
+            expireAfterSeconds=DUPLICATES_RETENTION_DAYS * DAY,
+            partialFilterExpression={"status": "resolved"},
+        ),
+    ]),
+    (OTHER_DB_URI, DATABASE_NAME, "files", [
+        IndexModel([("text", TEXT), ("file_name", TEXT), ("caption", TEXT), ("tags", TEXT)]),
+        IndexModel([("keywords", ASCENDING)]),
+    ]),
+    (OTHER_DB_URI, DATABASE_NAME, "nlp_cache", [
+        IndexModel([("query_hash", ASCENDING)]),
+        IndexModel([("timestamp", ASCENDING)], expireAfterSeconds=NLP_CACHE_TTL),
+    ]),
+    (OTHER_DB_URI, DATABASE_NAME, "manual_filters", [
+        IndexModel([("group_id", ASCENDING), ("text", ASCENDING)], unique=True),
+    ]),
+    (OTHER_DB_URI, "RequestDb", "join_requests", [IndexModel([("user_id", ASCENDING)])]),
+    (FILE_DB_URI, DATABASE_NAME, COLLECTION_NAME, [
+        IndexModel([("file_id", ASCENDING)]),
+        IndexModel([("file_name", ASCENDING)]),
+    ]),
+]
+
+if MULTIPLE_DATABASE:
+    MANIFEST.append((SEC_FILE_DB_URI, DATABASE_NAME, COLLECTION_NAME, [
+        IndexModel([("file_id", ASCENDING)]),
+        IndexModel([("file_name", ASCENDING)]),
+    ]))
+
+
+def _collections(collections=None):
+    for uri, database, collection, indexes in MANIFEST:
+        if not uri or (collections and collection not in collections):
+            continue
+        yield get_mongo_client(uri)[database][collection], indexes
+
+def _sync_options(collection, indexes):
+    """
+    Sets expireAfterSeconds and unique of the existing indexes to the values of the manifest, with collMod.
+    Otherwise create_indexes fails when a retention setting changes or a plain index becomes a TTL or unique one.
+    Making an index unique fails while the collection has duplicates, they have to be removed by hand.
+    """
+    existing = collection.index_information()
+    for index in indexes:
+        document = index.document
+        current = existing.get(document["name"])
+        if current is None:
+            continue
+        if document.get("unique") and not current.get("unique"):
+            for option in ("prepareUnique", "unique"):
+                collection.database.command("collMod", collection.name, index={"name": document["name"], option: True})
+            logger.info(f"{collection.full_name}.{document['name']} is now unique")
+        if "expireAfterSeconds" in document and current.get("expireAfterSeconds") != document["expireAfterSeconds"]:
+            collection.database.command(
+                "collMod", collection.name,
+                index={"name": document["name"], "expireAfterSeconds": document["expireAfterSeconds"]},
+            )
+            logger.info(f"{collection.full_name}.{document['name']} now expires after {document['expireAfterSeconds']}s")
+
+def _hold_ttl(collection, indexes):
+    """
+    Leaves the TTL index of the raw analytics events out until backfill_rollups has rolled them up,
+    and drops it if it was created before, so no event expires before the rollups count it.
+    """
+    ttl = [index for index in indexes if "expireAfterSeconds" in index.document]
+    existing = collection.index_information()
+    for index in ttl:
+        if index.document["name"] in existing:
+            collection.drop_index(index.document["name"])
+    logger.warning(f"The TTL of {collection.full_name} is held until the rollups backfill finishes, see database/backfill.py")
+    return [index for index in indexes if index not in ttl]
+
+def apply_indexes(collections=None):
+    """Creates the indexes of the manifest that don't exist yet, returns how many collections failed."""
+    failed = 0
+    for collection, indexes in _collections(collections):
+        try:
+            if collection.name == "user_analytics" and not rollups_backfilled(collection.database):
+                indexes = _hold_ttl(collection, indexes)
+            _sync_options(collection, indexes)
+            collection.create_indexes(indexes)
+        except OperationFailure as e:
+            # Usually an index with the same keys but another name or options already exists.
+            logger.warning(f"Couldn't create the indexes of {collection.full_name}: {e}")
+            failed += 1
+        except PyMongoError as e:
+            logger.error(f"Couldn't create the indexes of {collection.full_name}: {e}")
+            failed += 1
+    logger.info("Database indexes are up to date" if not failed else f"Indexes of {failed} collections failed")
+    return failed
+
+def index_report(collections=None):
+    """
+    Returns (collection, index, status, ops) rows, status is missing, unused or used.
+    ops is the number of uses $indexStats counted since the server started.
+    """
+    rows = []
+    for collection, indexes in _collections(collections):
+        try:
+            existing = collection.index_information()
+            usage = {
+                stats["name"]: stats["accesses"]["ops"]
+                for stats in collection.aggregate([{"$indexStats": {}}])
+            }
+        except PyMongoError as e:
+            logger.error(f"Couldn't read the indexes of {collection.full_name}: {e}")
+            continue
+        wanted = [index.document["name"] for index in indexes]
+        for name in wanted:
+            if name not in existing:
+                rows.append((collection.full_name, name, "missing", 0))
+        for name in existing:
+            if name == "_id_":
+                continue
+            ops = usage.get(name, 0)
+            rows.append((collection.full_name, name, "used" if ops else "unused", ops))
+    return rows
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if "--report" in sys.argv:
+        for collection, name, status, ops in index_report():
+            print(f"{collection:<40} {name:<32} {status:<8} {ops}")
+    else:
+        sys.exit(1 if apply_indexes() else 0)
@@ -0,0 +1,71 @@
+import motor.motor_asyncio
+from pymongo.errors import DuplicateKeyError
+from pyrogram.file_id import FileId, FileUniqueId, FileUniqueType
+from database.db_helpers import get_mongo_client, get_async_mongo_client
+from info import DATABASE_NAME, OTHER_DB_URI
+from main.util.cache import TTLCache
+from main.util.file_properties import get_media_from_message
+
+def get_unique_id(file_id: str) -> str:
+    """Returns the file_unique_id telegram uses for the file behind a file_id."""
+    decoded = FileId.decode(file_id)
+    return FileUniqueId(file_unique_type=FileUniqueType.DOCUMENT, media_id=decoded.media_id).encode()
+
+def describe(message):
+    """Returns what stream links need to know about a media message of the log channel."""
+    media = get_media_from_message(message)
+    return {
+        "_id": get_unique_id(media.file_id),
+        "msg_id": message.id,
+        "file_id": media.file_id,
+        "file_name": getattr(media, "file_name", "") or "",
+        "mime_type": getattr(media, "mime_type", "") or "",
+        "file_size": getattr(media, "file_size", 0) or 0,
+        "date": int(message.date.timestamp()) if message.date else 0,
+        "unique_id": getattr(media, "file_unique_id", "") or "",
+        "hash": (getattr(media, "file_unique_id", "") or "")[:6],
+    }
+
+class LogCopies:
+    def __init__(self):
+        """
+        Remembers the log channel copy of every file, by file_unique_id.
+        Stream links reuse the copy instead of forwarding the file again.
+        A LRU keeps the recently delivered files out of the database.
+        """
+        self._client = get_async_mongo_client(OTHER_DB_URI)
+        self.db = self._client[DATABASE_NAME]
+        self.copies = self.db.log_copies
+        self.cache = TTLCache(maxsize=5000)
+
+    async def get(self, unique_id):
+        """Returns the saved copy of a file, or None if it was never forwarded"""
+        copy = self.cache.get(unique_id)
+        if copy is None:
+            copy = await self.copies.find_one({"_id": unique_id})
+            if copy is not None:
+                self.cache.set(unique_id, copy)
+        return copy
+
+    async def save(self, message):
+        """Saves the log channel message of a file and returns its copy"""
+        copy = describe(message)
+        try:
+            await self.copies.insert_one(copy)
+        except DuplicateKeyError:
+            # Forwarded at the same time by another delivery, keep the first copy.
+            copy = await self.copies.find_one({"_id": copy["_id"]}) or copy
+        self.cache.set(copy["_id"], copy)
+        return copy
+
+    async def forget(self, unique_id):
+        """Drops a copy, e.g. when its message was deleted from the log channel"""
+        self.cache.pop(unique_id)
+        await self.copies.delete_one({"_id": unique_id})
+
+    async def forget_message(self, msg_id):
+        """Drops the copies saved for a log channel message, for links that only know the message id"""
+        async for copy in self.copies.find({"msg_id": msg_id}, {"_id": 1}):
+            await self.forget(copy["_id"])
+
+log_copies = LogCopies()
@@ -0,0 +1,127 @@
+"""
+Retention of the analytics and cache collections.
+
+Raw analytics events, rollups, the nlp cache and resolved duplicates expire through the TTL indexes
+of database/indexes.py, the raw events only once database/backfill.py rolled up the older ones. The per day counters of file_stats are keys of one document, so they are
+pruned here in batches. The storage report compares collStats with the first snapshot taken since
+the bot started:
+
+    python -m database.retention            # storage report
+    python -m database.retention --prune    # prune old daily counters, then report
+"""
+import sys
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from pymongo.errors import PyMongoError
+from info import DATABASE_NAME, OTHER_DB_URI, FILE_STATS_RETENTION_DAYS, RETENTION_INTERVAL
+from database.db_helpers import get_mongo_client
+
+logger = logging.getLogger(__name__)
+
+COLLECTIONS = ("user_analytics", "analytics_rollups", "file_stats", "nlp_cache", "detected_duplicates")
+
+_baseline = {}
+
+
+def _database():
+    return get_mongo_client(OTHER_DB_URI)[DATABASE_NAME]
+
+def storage_stats():
+    """Returns {collection: {count, size, storage_size, free_storage_size, index_size}} in bytes"""
+    database = _database()
+    stats = {}
+    for name in COLLECTIONS:
+        try:
+            result = database.command("collStats", name)
+        except PyMongoError as e:
+            logger.warning(f"Couldn't read the stats of {name}: {e}")
+            continue
+        stats[name] = {
+            "count": result.get("count", 0),
+            "size": result.get("size", 0),
+            "storage_size": result.get("storageSize", 0),
+            "free_storage_size": result.get("freeStorageSize", 0),
+            "index_size": result.get("totalIndexSize", 0),
+        }
+    return stats
+
+def snapshot_baseline():
+    """Remembers the current stats as the point storage_report compares with"""
+    _baseline.clear()
+    _baseline.update(storage_stats())
+
+def storage_report():
+    """
+    Returns one row per collection with the stats at the baseline (before) and now (after).
+    reclaimed is how much smaller the data and indexes are, the space is reused by new
+    documents and is only given back to the disk by compact.
+    """
+    if not _baseline:
+        snapshot_baseline()
+    rows = []
+    for name, after in storage_stats().items():
+        before = _baseline.get(name, after)
+        rows.append({
+            "collection": name,
+            "before": before,
+            "after": after,
+            "removed": before["count"] - after["count"],
+            "reclaimed": before["size"] + before["index_size"] - after["size"] - after["index_size"],
+        })
+    return rows
+
+
+def prune_daily_counts(days=FILE_STATS_RETENTION_DAYS, batch_size=1000):
+    """Removes the daily_counts of file_stats older than days, batch_size documents at a time. Returns the documents changed."""
+    file_stats = _database().file_stats
+    cutoff = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    # The keys are %Y-%m-%d dates, so they compare as strings.
+    keep_recent = [{"$set": {"daily_counts": {"$arrayToObject": {"$filter": {
+        "input": {"$objectToArray": "$daily_counts"},
+        "cond": {"$gte": ["$$this.k", cutoff]},
+    }}}}}]
+    changed = 0
+    last_id = None
+    while True:
+        query = {"daily_counts": {"$type": "object"}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        ids = [doc["_id"] for doc in file_stats.find(query, {"_id": 1}).sort("_id", 1).limit(batch_size)]
+        if not ids:
+            break
+        changed += file_stats.update_many({"_id": {"$in": ids}}, keep_recent).modified_count
+        last_id = ids[-1]
+    return changed
+
+async def run_retention():
+    """Prunes old daily counters every RETENTION_INTERVAL hours and logs what was reclaimed"""
+    await asyncio.to_thread(snapshot_baseline)
+    while RETENTION_INTERVAL:
+        try:
+            changed = await asyncio.to_thread(prune_daily_counts)
+            reclaimed = sum(row["reclaimed"] for row in await asyncio.to_thread(storage_report))
+            logger.info(f"Pruned the daily counters of {changed} files, {reclaimed / 1024 / 1024:.1f} MiB reclaimed since startup")
+        except PyMongoError as e:
+            logger.error(f"Retention run failed: {e}")
+        await asyncio.sleep(RETENTION_INTERVAL * 60 * 60)
+
+
+def format_report(rows):
+    lines = [f"{'collection':<22} {'docs':>10} {'removed':>9} {'data MiB':>9} {'index MiB':>9} {'reclaimed MiB':>13}"]
+    for row in rows:
+        after = row["after"]
+        lines.append(
+            f"{row['collection']:<22} {after['count']:>10} {row['removed']:>9} "
+            f"{after['size'] / 1024 / 1024:>9.1f} {after['index_size'] / 1024 / 1024:>9.1f} "
+            f"{row['reclaimed'] / 1024 / 1024:>13.1f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    snapshot_baseline()
+    if "--prune" in sys.argv:
+        print(f"Pruned the daily counters of {prune_daily_counts()} files")
+    print(format_report(storage_report()))
@@ -1,10 +1,15 @@
 import motor.motor_asyncio
+from pymongo import ReturnDocument
 from pymongo.errors import DuplicateKeyError
 from database.db_helpers import get_mongo_client, get_async_mongo_client
-from info import DATABASE_NAME, OTHER_DB_URI
+from main.util.cache import TTLCache
+from info import DATABASE_NAME, OTHER_DB_URI, TIER_CONFIG_REFRESH, USER_TIER_CACHE_TTL, USER_TIER_CACHE_SIZE
 from datetime import datetime, timedelta
+import copy
 import time
 
+_USAGE_FIELDS = {"_id": 0, "requests_today": 1, "last_request_date": 1}
+
 class TieredAccess:
     """
     Handle tiered access levels for users
@@ -20,6 +25,15 @@ class TieredAccess:
         self.db = self._client[DATABASE_NAME]
         self.tiers = self.db.user_tiers
         self.tier_config = self.db.tier_config
+        # One document per user and day, _id "<user_id>:<day>", so counting never needs a unique index.
+        self.usage = self.db.tier_usage
+        # Tier configs rarely change, they are reloaded by update_tier_config or every TIER_CONFIG_REFRESH seconds.
+        self.configs = {}
+        self._configs_loaded_at = 0.0
+        # User tier records, written through by the methods below. Callers get copies.
+        self.user_cache = TTLCache(USER_TIER_CACHE_SIZE, USER_TIER_CACHE_TTL)
+        # user id -> (day, requests left), users with none left are rejected by increment_usage without a query.
+        self.quotas = TTLCache(USER_TIER_CACHE_SIZE, 24 * 60 * 60)
         
     async def initialize(self):
         """Initialize default tier configurations if they don't exist"""
@@ -93,42 +107,58 @@ class TieredAccess:
                 {"$set": tier},
                 upsert=True
             )
+        await self.load_tier_configs()
+    
+    async def load_tier_configs(self):
+        """Reloads every tier config into memory"""
+        configs = await self.tier_config.find().to_list(length=100)
+        self.configs = {config["tier_name"]: config for config in configs}
+        self._configs_loaded_at = time.monotonic()
+    
+    async def get_tier_config(self, tier_name):
+        """Returns the config of a tier from memory, or None if the tier doesn't exist"""
+        if not self.configs or time.monotonic() - self._configs_loaded_at > TIER_CONFIG_REFRESH:
+            await self.load_tier_configs()
+        return self.configs.get(tier_name)
+    
+    def default_user_tier(self, user_id):
+        """The tier record of a user who never got one"""
+        return {
+            "user_id": user_id,
+            "tier": "free",
+            "expiry": None,
+            "usage": {
+                "requests_today": 0,
+                "last_request_date": None
+            },
+            "features_override": {}  # Custom overrides for specific features
+        }
     
     async def get_user_tier(self, user_id):
         """Get the current tier for a user"""
-        user_tier = await self.tiers.find_one({"user_id": user_id})
-        
-        if not user_tier:
-            # Default to free tier
-            return {
-                "user_id": user_id,
-                "tier": "free",
-                "expiry": None,
-                "usage": {
-                    "requests_today": 0,
-                    "last_request_date": None
-                },
-                "features_override": {}  # Custom overrides for specific features
-            }
+        user_tier = self.user_cache.get(user_id)
+        if user_tier is None:
+            user_tier = await self.tiers.find_one({"user_id": user_id})
             
-        # Reset request count if it's a new day
-        if user_tier.get("usage", {}).get("last_request_date") != datetime.now().strftime("%Y-%m-%d"):
+            if not user_tier:
+                # Default to free tier
+                user_tier = self.default_user_tier(user_id)
+            user_tier["usage"] = await self.usage.find_one(
+                {"_id": f"{user_id}:{datetime.now().strftime('%Y-%m-%d')}"}, _USAGE_FIELDS
+            ) or {}
+            self.user_cache.set(user_id, user_tier)
+        
+        user_tier = copy.deepcopy(user_tier)
+        # A cached count from another day is stale, today's count is a new document
+        if user_tier["usage"].get("last_request_date") != datetime.now().strftime("%Y-%m-%d"):
             user_tier["usage"]["requests_today"] = 0
-            user_tier["usage"]["last_request_date"] = datetime.now().strftime("%Y-%m-%d")
-            await self.tiers.update_one(
-                {"user_id": user_id},
-                {"$set": {
-                    "usage.requests_today": 0,
-                    "usage.last_request_date": datetime.now().strftime("%Y-%m-%d")
-                }}
-            )
             
         return user_tier
     
     async def set_user_tier(self, user_id, tier_name, duration_days=30):
         """Set a user's tier with an expiry date"""
         # Check if the tier exists
-        tier_exists = await self.tier_config.find_one({"tier_name": tier_name})
+        tier_exists = await self.get_tier_config(tier_name)
         if not tier_exists:
             return False, f"Tier '{tier_name}' does not exist"
         
@@ -145,13 +175,49 @@ class TieredAccess:
             }},
             upsert=True
         )
+        self.user_cache.pop(user_id)
+        self.quotas.pop(user_id)
         
         return True, f"User {user_id} has been assigned to tier '{tier_name}' for {duration_days} days"
     
+    async def _count_request(self, user_id, today):
+        """
+        Adds one request to the user's count of today in a single atomic upsert and returns the usage.
+        The day is part of the _id, so the first request of a day starts a new count and two
+        first requests can't create two counts. Old days expire through the TTL index on expires_at.
+        """
+        update = {
+            "$inc": {"requests_today": 1},
+            "$setOnInsert": {
+                "user_id": user_id,
+                "last_request_date": today,
+                "expires_at": datetime.now() + timedelta(days=2),
+            },
+        }
+        try:
+            return await self.usage.find_one_and_update(
+                {"_id": f"{user_id}:{today}"}, update, projection=_USAGE_FIELDS,
+                upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Lost the insert to a concurrent first request, the document exists now
+            return await self.usage.find_one_and_update(
+                {"_id": f"{user_id}:{today}"}, update, projection=_USAGE_FIELDS,
+                upsert=True, return_document=ReturnDocument.AFTER
+            )
+    
     async def increment_usage(self, user_id):
         """Increment the usage count for a user and check if they've reached their limit"""
+        # Get today's date
+        today = datetime.now().strftime("%Y-%m-%d")
+        
+        # Users known to be over their limit today are rejected without touching the database
+        quota = self.quotas.get(user_id)
+        if quota is not None and quota[0] == today and quota[1] <= 0:
+            return False
+        
         user_tier = await self.get_user_tier(user_id)
-        tier_config = await self.tier_config.find_one({"tier_name": user_tier["tier"]})
+        tier_config = await self.get_tier_config(user_tier["tier"]) or {}
         
         # Check if user's tier has expired
         if user_tier.get("expiry") and user_tier["expiry"] < datetime.now():
@@ -165,40 +231,27 @@ class TieredAccess:
                 }}
             )
             user_tier["tier"] = "free"
-            tier_config = await self.tier_config.find_one({"tier_name": "free"})
+            user_tier["expiry"] = None
+            tier_config = await self.get_tier_config("free") or {}
         
-        # Get today's date
-        today = datetime.now().strftime("%Y-%m-%d")
-        
-        # Reset counter if it's a new day
-        if user_tier.get("usage", {}).get("last_request_date") != today:
-            await self.tiers.update_one(
-                {"user_id": user_id},
-                {"$set": {
-                    "usage.requests_today": 1,
-                    "usage.last_request_date": today
-                }}
-            )
-            return True
-        
-        # Increment the counter
-        new_count = user_tier.get("usage", {}).get("requests_today", 0) + 1
-        await self.tiers.update_one(
-            {"user_id": user_id},
-            {"$set": {"usage.requests_today": new_count}}
-        )
+        usage = await self._count_request(user_id, today)
+        user_tier["usage"] = usage
+        self.user_cache.set(user_id, user_tier)
         
         # Check if user has reached their limit
         max_requests = tier_config.get("max_requests_per_day", 0)
-        if max_requests > 0 and new_count > max_requests:
-            return False
+        if max_requests > 0:
+            # Requests left today, refilled by the first request of the next day
+            self.quotas.set(user_id, (today, max_requests - usage["requests_today"]))
+            if usage["requests_today"] > max_requests:
+                return False
             
         return True
     
     async def can_use_feature(self, user_id, feature_name):
         """Check if a user can use a specific feature based on their tier"""
         user_tier = await self.get_user_tier(user_id)
-        tier_config = await self.tier_config.find_one({"tier_name": user_tier["tier"]})
+        tier_config = await self.get_tier_config(user_tier["tier"]) or {}
         
         # Check for feature override first
         if user_tier.get("features_override", {}).get(feature_name) is not None:
@@ -213,6 +266,7 @@ class TieredAccess:
             {"user_id": user_id},
             {"$set": {f"features_override.{feature_name}": allowed}}
         )
+        self.user_cache.pop(user_id)
         
     async def get_all_tiers(self):
         """Get all tier configurations"""
@@ -220,10 +274,13 @@ class TieredAccess:
     
     async def update_tier_config(self, tier_name, config_data):
         """Update a tier's configuration"""
-        return await self.tier_config.update_one(
+        result = await self.tier_config.update_one(
             {"tier_name": tier_name}, 
             {"$set": config_data}
         )
+        await self.load_tier_configs()
+        self.quotas.clear()
+        return result
     
     async def get_users_by_tier(self, tier_name):
         """Get all users in a specific tier"""
@@ -4,10 +4,12 @@ import re
 from pymongo.errors import DuplicateKeyError
 import motor.motor_asyncio
 from pymongo import MongoClient
-from info import DATABASE_NAME, USER_DB_URI, OTHER_DB_URI, CUSTOM_FILE_CAPTION, IMDB, IMDB_TEMPLATE, MELCOW_NEW_USERS, BUTTON_MODE, SPELL_CHECK_REPLY, PROTECT_CONTENT, AUTO_DELETE, MAX_BTN, AUTO_FFILTER, SHORTLINK_API, SHORTLINK_URL, SHORTLINK_MODE, TUTORIAL, IS_TUTORIAL
+from info import DATABASE_NAME, USER_DB_URI, OTHER_DB_URI, SETTINGS_CACHE_SIZE, SETTINGS_CACHE_TTL, CUSTOM_FILE_CAPTION, IMDB, IMDB_TEMPLATE, MELCOW_NEW_USERS, BUTTON_MODE, SPELL_CHECK_REPLY, PROTECT_CONTENT, AUTO_DELETE, MAX_BTN, AUTO_FFILTER, SHORTLINK_API, SHORTLINK_URL, SHORTLINK_MODE, TUTORIAL, IS_TUTORIAL
 import time
 import datetime
 from database.db_helpers import get_mongo_client, get_async_mongo_client
+from main.util.cache import TTLCache
+from main.util import metrics
 
 my_client = get_mongo_client(OTHER_DB_URI)
 mydb = my_client["referal_user"]
@@ -65,6 +67,8 @@ class Database:
         self.grp = self.db.groups
         self.users = self.db.uersz
         self.bot = self.db.clone_bots
+        # Group settings are read several times per message, keep them in memory.
+        self.settings_cache = TTLCache(maxsize=SETTINGS_CACHE_SIZE, ttl=SETTINGS_CACHE_TTL)
 
 
     def new_user(self, id, name):
@@ -201,13 +205,17 @@ class Database:
         
     async def update_settings(self, id, settings):
         await self.grp.update_one({'id': int(id)}, {'$set': {'settings': settings}})
+        self.settings_cache.set(int(id), dict(settings))
         
     
     async def get_settings(self, id):
-        chat = await self.grp.find_one({'id':int(id)})
-        if chat:
-            return chat.get('settings', default_setgs)
-        return default_setgs
+        settings = self.settings_cache.get(int(id))
+        if settings is None:
+            chat = await self.grp.find_one({'id':int(id)})
+            settings = chat.get('settings', default_setgs) if chat else default_setgs
+            self.settings_cache.set(int(id), dict(settings))
+        # A copy, so callers changing it don't change the cache
+        return dict(settings)
     
 
     async def disable_chat(self, chat, reason="No Reason"):
@@ -308,3 +316,17 @@ class Database:
     
 
 db = Database(USER_DB_URI, DATABASE_NAME)
+
+@metrics.register_collector
+def _settings_cache_metrics():
+    return [
+        "# HELP bot_settings_cache_hits_total Group settings served from memory.",
+        "# TYPE bot_settings_cache_hits_total counter",
+        f"bot_settings_cache_hits_total {db.settings_cache.hits}",
+        "# HELP bot_settings_cache_misses_total Group settings read from the database.",
+        "# TYPE bot_settings_cache_misses_total counter",
+        f"bot_settings_cache_misses_total {db.settings_cache.misses}",
+        "# HELP bot_settings_cache_size Groups whose settings are in memory.",
+        "# TYPE bot_settings_cache_size gauge",
+        f"bot_settings_cache_size {len(db.settings_cache)}",
+    ]
@@ -60,6 +60,13 @@ DATABASE_URI = environ.get('DATABASE_URI', "")   # IF Multiple Database Is False
 DATABASE_NAME = environ.get('DATABASE_NAME', "filterbot")
 COLLECTION_NAME = environ.get('COLLECTION_NAME', 'filecollection')
 
+# Every module shares one client per database url, these size its connection pool.
+MONGO_MAX_POOL_SIZE = int(environ.get('MONGO_MAX_POOL_SIZE', 20))
+MONGO_MIN_POOL_SIZE = int(environ.get('MONGO_MIN_POOL_SIZE', 0))
+MONGO_MAX_IDLE_TIME_MS = int(environ.get('MONGO_MAX_IDLE_TIME_MS', 60000)) # Idle connections are closed after this.
+MONGO_COMPRESSORS = environ.get('MONGO_COMPRESSORS', 'zlib') # Comma separated, e.g. zstd,snappy,zlib. Empty to disable.
+APPLY_INDEXES = bool(environ.get('APPLY_INDEXES', True)) # Create the missing indexes of database/indexes.py at startup.
+
 MULTIPLE_DATABASE = bool(environ.get('MULTIPLE_DATABASE', False)) # Set True or False
 
 # If Multiple Database Is True Then Fill All Three Below Database Uri Else You Will Get Error.
@@ -160,6 +167,52 @@ else:
     ON_HEROKU = False
 URL = environ.get("URL", "https://filter-bot-demo.herokuapp.com/")
 
+# Signed stream links carry the file location inside the url, so the stream server don't need to fetch the log channel message.
+SIGNED_LINKS = bool(environ.get('SIGNED_LINKS', True)) # Set True or False
+STREAM_SECRET = environ.get('STREAM_SECRET', '') # Secret key used to sign stream links, if empty then bot token is used.
+SIGNED_LINK_EXPIRY = int(environ.get('SIGNED_LINK_EXPIRY', 0)) # Link validity in seconds, 0 means link never expire.
+STREAM_CACHE_MAX_AGE = int(environ.get('STREAM_CACHE_MAX_AGE', 86400)) # How long browsers and caches in front of the bot may keep a file, in seconds.
+METRICS_TOKEN = environ.get('METRICS_TOKEN', '') # Bearer token Prometheus sends to read /metrics, if empty then /metrics is disabled.
+
+# Media sessions for every DC are opened at startup and their auth keys are saved here, so restarts skip the handshake.
+PREWARM_MEDIA_SESSIONS = bool(environ.get('PREWARM_MEDIA_SESSIONS', True)) # Set True or False
+MEDIA_SESSION_DIR = environ.get('MEDIA_SESSION_DIR', 'media_sessions')
+MEDIA_SESSION_CHECK_INTERVAL = int(environ.get('MEDIA_SESSION_CHECK_INTERVAL', 300)) # in seconds
+
+# Chunk fetches are shared fairly between users, paid tiers get a bigger share.
+STREAM_FETCH_SLOTS = int(environ.get('STREAM_FETCH_SLOTS', 0)) # Concurrent GetFile calls for all users, 0 means 4 per client.
+STREAM_MAX_PER_USER = int(environ.get('STREAM_MAX_PER_USER', 3)) # Concurrent streams per user, 0 means unlimited.
+STREAM_MAX_PER_IP = int(environ.get('STREAM_MAX_PER_IP', 0)) # Concurrent streams per IP for links made without a user, 0 means unlimited.
+STREAM_USER_RATE = int(environ.get('STREAM_USER_RATE', 0)) # Bytes per second per free user, paid tiers get a multiple of it, 0 means unlimited.
+
+# Group settings are cached in memory, changes made by the bot are written through at once.
+SETTINGS_CACHE_TTL = int(environ.get('SETTINGS_CACHE_TTL', 300)) # in seconds
+SETTINGS_CACHE_SIZE = int(environ.get('SETTINGS_CACHE_SIZE', 5000)) # Number of groups kept in memory.
+
+# Tier configs and user tiers are cached in memory, changes made by the bot are written through at once.
+TIER_CONFIG_REFRESH = int(environ.get('TIER_CONFIG_REFRESH', 300)) # Seconds between reloads of the tier configs.
+USER_TIER_CACHE_TTL = int(environ.get('USER_TIER_CACHE_TTL', 300)) # in seconds
+USER_TIER_CACHE_SIZE = int(environ.get('USER_TIER_CACHE_SIZE', 10000)) # Number of users kept in memory.
+
+# Analytics events are buffered and written in batches.
+ANALYTICS_BATCH_SIZE = int(environ.get('ANALYTICS_BATCH_SIZE', 500)) # Flush after this many events.
+ANALYTICS_FLUSH_INTERVAL = int(environ.get('ANALYTICS_FLUSH_INTERVAL', 10)) # Flush at least every this many seconds.
+ANALYTICS_MAX_BUFFER = int(environ.get('ANALYTICS_MAX_BUFFER', 20000)) # Events over this are dropped while the database is slow.
+TOP_K_CAPACITY = int(environ.get('TOP_K_CAPACITY', 200)) # Searches and files tracked per hour for the live top lists.
+TOP_K_HOURS = int(environ.get('TOP_K_HOURS', 168)) # Hours the live top lists keep.
+TOP_K_SNAPSHOT_INTERVAL = int(environ.get('TOP_K_SNAPSHOT_INTERVAL', 300)) # Seconds between snapshots of the top lists.
+DASHBOARD_CACHE_TTL = int(environ.get('DASHBOARD_CACHE_TTL', 30)) # Seconds the admin dashboard is served from memory before a background refresh.
+DASHBOARD_CACHE_STALE = int(environ.get('DASHBOARD_CACHE_STALE', 300)) # Seconds a stale dashboard is still served while it refreshes.
+
+# Retention, old documents are removed by TTL indexes and a daily prune job.
+ANALYTICS_RETENTION_DAYS = int(environ.get('ANALYTICS_RETENTION_DAYS', 30)) # Raw analytics events, the rollups keep the totals.
+ANALYTICS_HOURLY_RETENTION_DAYS = int(environ.get('ANALYTICS_HOURLY_RETENTION_DAYS', 14))
+ANALYTICS_DAILY_RETENTION_DAYS = int(environ.get('ANALYTICS_DAILY_RETENTION_DAYS', 400))
+FILE_STATS_RETENTION_DAYS = int(environ.get('FILE_STATS_RETENTION_DAYS', 90)) # Per day access counters of each file.
+DUPLICATES_RETENTION_DAYS = int(environ.get('DUPLICATES_RETENTION_DAYS', 30)) # Resolved duplicates, unresolved ones are kept.
+NLP_CACHE_TTL = int(environ.get('NLP_CACHE_TTL', 3600)) # in seconds
+RETENTION_INTERVAL = int(environ.get('RETENTION_INTERVAL', 24)) # Hours between prune runs, 0 disables the job.
+
 
 # Rename Info : If True Then Bot Rename File Else Not
 RENAME_MODE = bool(environ.get('RENAME_MODE', False)) # Set True or False
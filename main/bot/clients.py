@@ -6,11 +6,13 @@ from info import *
 from pyrogram import Client
 from main.util.config_parser import TokenParser
 from main.bot import multi_clients, work_loads, MainBot
+from main.util.client_scheduler import client_scheduler
 
 
 async def initialize_clients():
     multi_clients[0] = MainBot
     work_loads[0] = 0
+    await client_scheduler.register(0, MainBot)
     all_tokens = TokenParser().parse_from_env()
     if not all_tokens:
         print("No additional clients found, using default client")
@@ -31,6 +33,7 @@ async def initialize_clients():
                 no_updates=True,
                 in_memory=True
             ).start()
+            await client_scheduler.register(client_id, client)
             work_loads[client_id] = 0
             return client_id, client
         except Exception:
@@ -5,10 +5,9 @@ from nltk.corpus import stopwords
 from nltk.stem import WordNetLemmatizer
 import re
 import string
-from pymongo import MongoClient, TEXT
-from pymongo.errors import OperationFailure
+from pymongo import MongoClient
 from database.db_helpers import get_mongo_client
-from info import DATABASE_NAME, OTHER_DB_URI
+from info import DATABASE_NAME, OTHER_DB_URI, NLP_CACHE_TTL
 import motor.motor_asyncio
 from database.analytics import analytics_db
 from database.tiered_access import tiered_access
@@ -39,29 +38,7 @@ class NLPSearchEngine:
         self.db = self.client[DATABASE_NAME]
         self.files = self.db.files
         self.nlp_cache = self.db.nlp_cache
-        self.ensure_indexes()
-        
-    def ensure_indexes(self):
-        """Ensure text indexes are created for search performance"""
-        try:
-            # Create text index on relevant fields
-            self.files.create_index([
-                ("text", "text"), 
-                ("file_name", "text"), 
-                ("caption", "text"),
-                ("tags", "text")
-            ])
-            
-            # Create index for exact keyword matches
-            self.files.create_index("keywords")
-            
-            # Create index for cache lookup
-            self.nlp_cache.create_index("query_hash")
-            self.nlp_cache.create_index("timestamp")
-            
-            logger.info("Search indexes created or already exist")
-        except OperationFailure as e:
-            logger.error(f"Failed to create index: {e}")
+        # The text indexes are declared in database/indexes.py and created at startup.
 
     def preprocess_text(self, text):
         """Preprocess text for better search results"""
@@ -188,8 +165,8 @@ class NLPSearchEngine:
         
         # Check cache first
         cache_hit = self.nlp_cache.find_one({"query_hash": query_hash})
-        if cache_hit and (datetime.now() - cache_hit["timestamp"]).total_seconds() < 3600:
-            # Cache is fresh (less than 1 hour old)
+        if cache_hit and (datetime.now() - cache_hit["timestamp"]).total_seconds() < NLP_CACHE_TTL:
+            # Cache is fresh, older entries are removed by the TTL index of nlp_cache
             return cache_hit["results"]
             
         # Generate MongoDB query
@@ -237,28 +214,23 @@ class AsyncNLPSearch:
             # User cannot use NLP search, return empty results
             return {"results": [], "error": "NLP search is a premium feature. Please upgrade your plan."}
             
-        # Track this search in analytics
-        asyncio.create_task(
-            analytics_db.track_activity(
-                user_id, 
-                "search", 
-                query=query, 
-                extra_data={"search_type": "nlp"}
-            )
-        )
-        
         # Run the search in a thread pool to avoid blocking
         loop = asyncio.get_event_loop()
+        extra_data = {"search_type": "nlp"}
         try:
             results = await loop.run_in_executor(
                 None, 
                 lambda: self.search_engine.search(query, limit)
             )
+            extra_data["results"] = len(results)
             
             return {"results": results, "error": None}
         except Exception as e:
             logger.error(f"Error in NLP search: {e}")
             return {"results": [], "error": str(e)}
+        finally:
+            # Track this search in analytics, with the number of results to find searches without any
+            await analytics_db.track_activity(user_id, "search", query=query, extra_data=extra_data)
 
 # Create a global instance
 nlp_search = AsyncNLPSearch() 
\ No newline at end of file
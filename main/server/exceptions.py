@@ -3,3 +3,6 @@ class InvalidHash(Exception):
 
 class FIleNotFound(Exception):
     message = "File not found"
+
+class LinkExpired(Exception):
+    message = "Link expired"
@@ -0,0 +1,88 @@
+import time
+import logging
+from typing import Dict, Optional
+from pyrogram import Client
+from main.bot import multi_clients, work_loads
+
+# Score weights, one point is roughly one more open stream on the client.
+INFLIGHT_BYTES_PER_POINT = 1024 * 1024
+LATENCY_PER_POINT = 0.25
+COLD_SESSION_PENALTY = 3
+LATENCY_SMOOTHING = 0.2
+MAX_FAILURES = 3
+MAX_BACKOFF = 300
+
+
+class ClientScheduler:
+    def __init__(self):
+        """Chooses which client serves a stream.
+        attributes:
+            inflight_bytes: bytes of the GetFile calls waiting for an answer, per client.
+            latency: moving average of the GetFile latency in seconds, per client.
+            failures: consecutive failed GetFile calls, per client.
+            ejected_until: monotonic time until which a client is skipped.
+            home_dc: the DC each client's own session lives on.
+
+        Clients with a ready media session on the file's DC are preferred, then the load is
+        weighted by open streams, bytes in flight and recent latency. Clients that hit a
+        FloodWait or keep failing are taken out of rotation for a while.
+        """
+        self.inflight_bytes: Dict[int, int] = {}
+        self.latency: Dict[int, float] = {}
+        self.failures: Dict[int, int] = {}
+        self.ejected_until: Dict[int, float] = {}
+        self.home_dc: Dict[int, int] = {}
+
+    async def register(self, index: int, client: Client) -> None:
+        self.home_dc[index] = await client.storage.dc_id()
+
+    def has_warm_session(self, index: int, dc_id: int) -> bool:
+        client = multi_clients[index]
+        return dc_id in client.media_sessions or self.home_dc.get(index) == dc_id
+
+    def is_available(self, index: int) -> bool:
+        return self.ejected_until.get(index, 0) <= time.monotonic()
+
+    def score(self, index: int, dc_id: Optional[int] = None) -> float:
+        score = work_loads.get(index, 0)
+        score += self.inflight_bytes.get(index, 0) / INFLIGHT_BYTES_PER_POINT
+        score += self.latency.get(index, 0) / LATENCY_PER_POINT
+        if dc_id is not None and not self.has_warm_session(index, dc_id):
+            score += COLD_SESSION_PENALTY
+        return score
+
+    def pick(self, dc_id: Optional[int] = None) -> int:
+        """Returns the index of the best client for a file on dc_id."""
+        candidates = [index for index in work_loads if self.is_available(index)]
+        if not candidates:
+            # Everyone is ejected, fall back to the client that comes back first.
+            return min(work_loads, key=lambda index: self.ejected_until.get(index, 0))
+        return min(candidates, key=lambda index: self.score(index, dc_id))
+
+    def begin(self, index: int, nbytes: int) -> None:
+        self.inflight_bytes[index] = self.inflight_bytes.get(index, 0) + nbytes
+
+    def end(self, index: int, nbytes: int) -> None:
+        self.inflight_bytes[index] = max(self.inflight_bytes.get(index, 0) - nbytes, 0)
+
+    def chunk_done(self, index: int, latency: float) -> None:
+        previous = self.latency.get(index)
+        self.latency[index] = latency if previous is None else (
+            previous + LATENCY_SMOOTHING * (latency - previous)
+        )
+        self.failures[index] = 0
+
+    def flood_wait(self, index: int, seconds: int) -> None:
+        logging.warning(f"Client {index} got FloodWait of {seconds}s, ejecting it")
+        self.ejected_until[index] = time.monotonic() + seconds
+
+    def failure(self, index: int) -> None:
+        failures = self.failures.get(index, 0) + 1
+        self.failures[index] = failures
+        if failures >= MAX_FAILURES:
+            backoff = min(5 * 2 ** (failures - MAX_FAILURES), MAX_BACKOFF)
+            logging.warning(f"Client {index} failed {failures} times in a row, ejecting it for {backoff}s")
+            self.ejected_until[index] = time.monotonic() + backoff
+
+
+client_scheduler = ClientScheduler()
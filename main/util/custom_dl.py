@@ -1,16 +1,44 @@
 import math
+import time
 import asyncio
 import logging
 from info import *
-from typing import Dict, Union
+from typing import Dict, Iterator, Optional, Tuple, Union
 from main.bot import work_loads
 from pyrogram import Client, utils, raw
 from main.util.file_properties import get_file_ids
-from pyrogram.session import Session, Auth
-from pyrogram.errors import AuthBytesInvalid
+from pyrogram.session import Session
+from pyrogram.errors import FloodWait, FileReferenceExpired, FileReferenceInvalid
+from main.util.media_sessions import get_media_session
+from main.util.client_scheduler import client_scheduler
+from main.util.fair_share import Flow, fair_share
+from main.util import metrics
 from main.server.exceptions import FIleNotFound
 from pyrogram.file_id import FileId, FileType, ThumbnailSource
 
+MIN_CHUNK_SIZE = 4 * 1024
+FIRST_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+
+
+def plan_chunks(from_bytes: int, until_bytes: int) -> Iterator[Tuple[int, int]]:
+    """
+    Yields the (offset, limit) pairs of the GetFile requests covering from_bytes..until_bytes.
+    The first request is small, so seeks and short ranges get their bytes quickly, and the
+    size doubles up to 1 MiB while reading on. Every limit is a power of two between 4 KiB
+    and 1 MiB and every offset is a multiple of its limit, as upload.GetFile requires.
+    """
+    length = until_bytes - from_bytes + 1
+    chunk_size = MIN_CHUNK_SIZE
+    while chunk_size < min(length, FIRST_CHUNK_SIZE):
+        chunk_size *= 2
+    offset = from_bytes - from_bytes % chunk_size
+    while offset <= until_bytes:
+        yield offset, chunk_size
+        offset += chunk_size
+        if chunk_size < MAX_CHUNK_SIZE and offset % (chunk_size * 2) == 0:
+            chunk_size *= 2
+
 
 class ByteStreamer:
     def __init__(self, client: Client):
@@ -40,8 +68,11 @@ class ByteStreamer:
         or it'll generate the properties from the Message ID and cache them.
         """
         if id not in self.cached_file_ids:
+            metrics.cache_miss("file_properties")
             await self.generate_file_properties(id)
             logging.debug(f"Cached file properties for message with ID {id}")
+        else:
+            metrics.cache_hit("file_properties")
         return self.cached_file_ids[id]
     
     async def generate_file_properties(self, id: int) -> FileId:
@@ -63,56 +94,7 @@ class ByteStreamer:
         Generates the media session for the DC that contains the media file.
         This is required for getting the bytes from Telegram servers.
         """
-
-        media_session = client.media_sessions.get(file_id.dc_id, None)
-
-        if media_session is None:
-            if file_id.dc_id != await client.storage.dc_id():
-                media_session = Session(
-                    client,
-                    file_id.dc_id,
-                    await Auth(
-                        client, file_id.dc_id, await client.storage.test_mode()
-                    ).create(),
-                    await client.storage.test_mode(),
-                    is_media=True,
-                )
-                await media_session.start()
-
-                for _ in range(6):
-                    exported_auth = await client.invoke(
-                        raw.functions.auth.ExportAuthorization(dc_id=file_id.dc_id)
-                    )
-
-                    try:
-                        await media_session.send(
-                            raw.functions.auth.ImportAuthorization(
-                                id=exported_auth.id, bytes=exported_auth.bytes
-                            )
-                        )
-                        break
-                    except AuthBytesInvalid:
-                        logging.debug(
-                            f"Invalid authorization bytes for DC {file_id.dc_id}"
-                        )
-                        continue
-                else:
-                    await media_session.stop()
-                    raise AuthBytesInvalid
-            else:
-                media_session = Session(
-                    client,
-                    file_id.dc_id,
-                    await client.storage.auth_key(),
-                    await client.storage.test_mode(),
-                    is_media=True,
-                )
-                await media_session.start()
-            logging.debug(f"Created media session for DC {file_id.dc_id}")
-            client.media_sessions[file_id.dc_id] = media_session
-        else:
-            logging.debug(f"Using cached media session for DC {file_id.dc_id}")
-        return media_session
+        return await get_media_session(client, file_id.dc_id)
 
 
     @staticmethod
@@ -164,61 +146,95 @@ class ByteStreamer:
         self,
         file_id: FileId,
         index: int,
-        offset: int,
-        first_part_cut: int,
-        last_part_cut: int,
-        part_count: int,
-        chunk_size: int,
+        from_bytes: int,
+        until_bytes: int,
+        flow: Optional[Flow] = None,
     ) -> Union[str, None]:
         """
-        Custom generator that yields the bytes of the media file.
+        Custom generator that yields the bytes from_bytes..until_bytes (inclusive) of the media file.
+        With a flow, every chunk waits for its fair share of the GetFile slots.
+        If telegram rejects the file reference, the file is resolved again from its log channel
+        message with this client and the chunk is retried once.
         Modded from <https://github.com/eyaadh/megadlbot_oss/blob/master/mega/telegram/utils/custom_download.py#L20>
         Thanks to Eyaadh <https://github.com/eyaadh>
         """
         client = self.client
         work_loads[index] += 1
+        metrics.stream_started(index)
         logging.debug(f"Starting to yielding file with client {index}.")
-        media_session = await self.generate_media_session(client, file_id)
 
-        current_part = 1
-        location = await self.get_location(file_id)
+        current_part = 0
 
+        try:
+            try:
+                media_session = await self.generate_media_session(client, file_id)
+            except Exception:
+                client_scheduler.failure(index)
+                raise
+            location = await self.get_location(file_id)
+
+            refreshed = False
+            for offset, chunk_size in plan_chunks(from_bytes, until_bytes):
+                async with fair_share.fetch_slot(flow, chunk_size):
+                    try:
+                        r = await self.get_file(media_session, index, location, offset, chunk_size)
+                    except (FileReferenceExpired, FileReferenceInvalid):
+                        message_id = getattr(file_id, "message_id", None)
+                        if refreshed or not message_id:
+                            raise
+                        logging.debug(f"File reference of message {message_id} rejected, resolving it again")
+                        refreshed = True
+                        self.cached_file_ids.pop(message_id, None)
+                        file_id = await self.get_file_properties(message_id)
+                        location = await self.get_location(file_id)
+                        r = await self.get_file(media_session, index, location, offset, chunk_size)
+                if not isinstance(r, raw.types.upload.File) or not r.bytes:
+                    break
+                chunk = r.bytes[max(from_bytes - offset, 0):until_bytes - offset + 1]
+                current_part += 1
+                metrics.add_bytes(index, len(chunk))
+                yield chunk
+        except (TimeoutError, AttributeError):
+            pass
+        finally:
+            logging.debug(f"Finished yielding file with {current_part} parts.")
+            work_loads[index] -= 1
+
+    async def get_file(
+        self,
+        media_session: Session,
+        index: int,
+        location,
+        offset: int,
+        limit: int,
+    ) -> raw.types.upload.File:
+        """
+        Requests one chunk of the file and reports its latency, flood waits and
+        failures to the client scheduler. The chunk counts as in flight until it arrives.
+        """
+        start = time.monotonic()
+        client_scheduler.begin(index, limit)
         try:
             r = await media_session.send(
                 raw.functions.upload.GetFile(
-                    location=location, offset=offset, limit=chunk_size
+                    location=location, offset=offset, limit=limit
                 ),
             )
-            if isinstance(r, raw.types.upload.File):
-                while True:
-                    chunk = r.bytes
-                    if not chunk:
-                        break
-                    elif part_count == 1:
-                        yield chunk[first_part_cut:last_part_cut]
-                    elif current_part == 1:
-                        yield chunk[first_part_cut:]
-                    elif current_part == part_count:
-                        yield chunk[:last_part_cut]
-                    else:
-                        yield chunk
-
-                    current_part += 1
-                    offset += chunk_size
-
-                    if current_part > part_count:
-                        break
-
-                    r = await media_session.send(
-                        raw.functions.upload.GetFile(
-                            location=location, offset=offset, limit=chunk_size
-                        ),
-                    )
-        except (TimeoutError, AttributeError):
-            pass
+        except FloodWait as e:
+            client_scheduler.flood_wait(index, e.value)
+            raise
+        except (FileReferenceExpired, FileReferenceInvalid):
+            # A problem of the file id, not of the client
+            raise
+        except Exception:
+            client_scheduler.failure(index)
+            raise
         finally:
-            logging.debug("Finished yielding file with {current_part} parts.")
-            work_loads[index] -= 1
+            client_scheduler.end(index, limit)
+        latency = time.monotonic() - start
+        client_scheduler.chunk_done(index, latency)
+        metrics.observe_get_file(media_session.dc_id, latency)
+        return r
 
     
     async def clean_cache(self) -> None:
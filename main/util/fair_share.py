@@ -0,0 +1,146 @@
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, Optional
+from info import STREAM_FETCH_SLOTS, STREAM_MAX_PER_USER, STREAM_USER_RATE
+from database.tiered_access import tiered_access
+from main.bot import multi_clients
+
+# Share of the fetch slots and of the rate ceiling each tier gets, relative to free users.
+TIER_WEIGHTS = {"free": 1, "premium": 2, "pro": 4, "enterprise": 8}
+FETCH_SLOTS_PER_CLIENT = 4
+
+
+class Flow:
+    def __init__(self, key: str, tier: str, max_streams: int = STREAM_MAX_PER_USER):
+        """The streams of one user (or one IP for links without a user).
+        attributes:
+            max_streams: streams the flow may have open at once, 0 means unlimited.
+            weight: share of the fetch slots, from the tier.
+            rate: bytes/s ceiling, 0 means unlimited.
+            finish: virtual finish time of the last chunk queued by this flow.
+            streams: streams currently open.
+            tokens: token bucket for the rate ceiling, negative when the flow is in debt.
+        """
+        self.key = key
+        self.tier = tier
+        self.max_streams = max_streams
+        self.weight = TIER_WEIGHTS.get(tier, 1)
+        self.rate = STREAM_USER_RATE * self.weight
+        self.finish = 0.0
+        self.streams = 0
+        self.tokens = float(self.rate)
+        self.updated = time.monotonic()
+
+
+class FairShare:
+    def __init__(self):
+        """Weighted fair queuing of GetFile chunk fetches between users.
+        Every chunk gets a virtual start time of max(virtual time, flow's last finish) and a finish
+        time of start + size / weight, free slots go to the waiting chunk with the smallest finish.
+        The virtual time moves to the start of every chunk granted, queued or not, so a flow that
+        fetched alone is not pushed behind newcomers once others show up. A user with many streams
+        only competes with its own chunks, and a premium user's chunks finish sooner.
+        """
+        self.flows: Dict[str, Flow] = {}
+        self.active = 0
+        self.virtual_time = 0.0
+        self._queue = []
+        self._seq = itertools.count()
+
+    @property
+    def slots(self) -> int:
+        return STREAM_FETCH_SLOTS or FETCH_SLOTS_PER_CLIENT * max(len(multi_clients), 1)
+
+    def get_flow(self, key: str, tier: str, max_streams: int = STREAM_MAX_PER_USER) -> Flow:
+        flow = self.flows.get(key)
+        if flow is None or flow.tier != tier:
+            flow = Flow(key, tier, max_streams)
+        return flow
+
+    def try_open(self, flow: Flow) -> bool:
+        """Reserves a stream for the flow, False if it already has max_streams open.
+        The check and the reservation happen without awaiting, so concurrent requests can't both pass.
+        Every successful call must be paired with stream_finished.
+        """
+        if flow.max_streams and flow.streams >= flow.max_streams:
+            return False
+        if self.flows.get(flow.key) is not flow:
+            self.flows[flow.key] = flow
+        flow.streams += 1
+        return True
+
+    def stream_finished(self, flow: Flow) -> None:
+        flow.streams -= 1
+        if flow.streams <= 0 and self.flows.get(flow.key) is flow:
+            del self.flows[flow.key]
+
+    async def throttle(self, flow: Flow, nbytes: int) -> None:
+        """Waits until the flow's token bucket allows nbytes more."""
+        if not flow.rate:
+            return
+        now = time.monotonic()
+        flow.tokens = min(flow.tokens + (now - flow.updated) * flow.rate, flow.rate)
+        flow.updated = now
+        flow.tokens -= nbytes
+        if flow.tokens < 0:
+            await asyncio.sleep(-flow.tokens / flow.rate)
+
+    async def acquire(self, flow: Flow, nbytes: int) -> None:
+        start = max(self.virtual_time, flow.finish)
+        flow.finish = start + nbytes / flow.weight
+        if self.active < self.slots and not self._queue:
+            self.virtual_time = start
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (flow.finish, next(self._seq), start, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the fetch got cancelled.
+                self.release()
+            raise
+
+    def release(self) -> None:
+        self.active -= 1
+        while self._queue and self.active < self.slots:
+            _, _, start, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            self.virtual_time = max(self.virtual_time, start)
+            self.active += 1
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def fetch_slot(self, flow: Optional[Flow], nbytes: int):
+        """Holds one of the shared GetFile slots for a chunk of nbytes."""
+        if flow is None:
+            yield
+            return
+        await self.throttle(flow, nbytes)
+        await self.acquire(flow, nbytes)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+async def get_user_tier_name(user_id: int) -> str:
+    """Returns the tier name of a user, from the user tier cache of tiered_access."""
+    try:
+        user_tier = await tiered_access.get_user_tier(user_id)
+    except Exception as e:
+        logging.warning(f"Couldn't get the tier of user {user_id}: {e}")
+        return "free"
+    if user_tier.get("expiry") and user_tier["expiry"] < datetime.now():
+        return "free"
+    return user_tier.get("tier", "free")
+
+
+fair_share = FairShare()
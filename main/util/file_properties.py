@@ -1,4 +1,5 @@
 from pyrogram import Client
+from pyrogram.errors import MessageIdInvalid
 from typing import Any, Optional
 from pyrogram.types import Message
 from pyrogram.file_id import FileId
@@ -17,7 +18,10 @@ async def parse_file_unique_id(message: "Messages") -> Optional[str]:
         return media.file_unique_id
 
 async def get_file_ids(client: Client, chat_id: int, id: int) -> Optional[FileId]:
-    message = await client.get_messages(chat_id, id)
+    try:
+        message = await client.get_messages(chat_id, id)
+    except MessageIdInvalid:
+        raise FIleNotFound
     if message.empty:
         raise FIleNotFound
     media = get_media_from_message(message)
@@ -27,6 +31,8 @@ async def get_file_ids(client: Client, chat_id: int, id: int) -> Optional[FileId
     setattr(file_id, "mime_type", getattr(media, "mime_type", ""))
     setattr(file_id, "file_name", getattr(media, "file_name", ""))
     setattr(file_id, "unique_id", file_unique_id)
+    setattr(file_id, "date", int(message.date.timestamp()) if message.date else 0)
+    setattr(file_id, "message_id", id)
     return file_id
 
 def get_media_from_message(message: "Message") -> Any:
@@ -0,0 +1,61 @@
+import math
+from hashlib import blake2b
+from typing import Iterable, Optional
+
+PRECISION = 10
+REGISTERS = 1 << PRECISION
+_ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+_REST_BITS = 64 - PRECISION
+
+
+def _hash(value) -> int:
+    return int.from_bytes(blake2b(str(value).encode(), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    def __init__(self, registers: Optional[bytes] = None):
+        """Approximate count of distinct values in a fixed 1 KiB, about 3% standard error.
+        The registers are stored as is in MongoDB (bytes), two sketches of the same values
+        merge into the sketch of their union by keeping the highest of each register.
+
+        A missing or malformed value (None, an old document) starts an empty sketch.
+        """
+        if registers is not None and len(registers) == REGISTERS:
+            self.registers = bytearray(registers)
+        else:
+            self.registers = bytearray(REGISTERS)
+
+    def add(self, value) -> None:
+        hashed = _hash(value)
+        index = hashed >> _REST_BITS
+        rest = hashed & ((1 << _REST_BITS) - 1)
+        rank = _REST_BITS - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values: Iterable) -> None:
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: "HyperLogLog") -> None:
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        estimate = _ALPHA * REGISTERS * REGISTERS / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * REGISTERS and zeros:
+            # Small cardinalities, linear counting is more accurate
+            estimate = REGISTERS * math.log(REGISTERS / zeros)
+        return round(estimate)
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+    @classmethod
+    def union(cls, sketches: Iterable[Optional[bytes]]) -> "HyperLogLog":
+        """Merges stored sketches, None entries are skipped."""
+        merged = cls()
+        for registers in sketches:
+            if registers is not None:
+                merged.merge(cls(registers))
+        return merged
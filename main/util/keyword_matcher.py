@@ -0,0 +1,106 @@
+import re
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+_word_char = re.compile(r"\w")
+
+
+def _is_boundary(text: str, index: int) -> bool:
+    """True if text[index] is outside the text or isn't a word character."""
+    return index < 0 or index >= len(text) or not _word_char.match(text[index])
+
+
+class KeywordMatcher:
+    def __init__(self, keywords: Iterable[str] = ()):
+        """Finds which of many keywords appear in a text, in one pass over the text.
+        It is an Aho-Corasick automaton over the lower cased keywords, a keyword only matches
+        as a whole word (the same rule as the old r"( |^|[^\\w])keyword( |$|[^\\w])" regex).
+
+        Adding a keyword extends the trie in place, the failure links are rebuilt on the next
+        match after a change. Removing a keyword rebuilds the trie on the next match.
+        """
+        self.keywords: Dict[str, str] = {}
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._terminal: List[Optional[str]] = [None]
+        self._out: List[List[str]] = [[]]
+        self._linked = True
+        self._stale = False
+        for keyword in keywords:
+            self.add(keyword)
+
+    def __len__(self) -> int:
+        return len(self.keywords)
+
+    def __contains__(self, keyword: str) -> bool:
+        return keyword.lower() in self.keywords
+
+    def add(self, keyword: str) -> None:
+        key = keyword.lower()
+        if not key:
+            return
+        self.keywords[key] = keyword
+        if not self._stale:
+            self._insert(key)
+
+    def remove(self, keyword: str) -> None:
+        if self.keywords.pop(keyword.lower(), None) is not None:
+            self._stale = True
+
+    def _insert(self, key: str) -> None:
+        node = 0
+        for char in key:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._terminal.append(None)
+                self._out.append([])
+            node = next_node
+        self._terminal[node] = key
+        self._linked = False
+
+    def _build(self) -> None:
+        if self._stale:
+            self._goto, self._fail, self._terminal, self._out = [{}], [0], [None], [[]]
+            self._stale = False
+            for key in self.keywords:
+                self._insert(key)
+        queue = deque()
+        for child in self._goto[0].values():
+            self._fail[child] = 0
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            own = self._terminal[node]
+            self._out[node] = ([own] if own else []) + self._out[self._fail[node]]
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0) if node else 0
+                queue.append(child)
+        self._linked = True
+
+    def find_all(self, text: str) -> List[str]:
+        """Returns every keyword found as a whole word in text, as they were added."""
+        if self._stale or not self._linked:
+            self._build()
+        text = text.lower()
+        found = {}
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for key in self._out[node]:
+                start = index - len(key) + 1
+                if key not in found and _is_boundary(text, start - 1) and _is_boundary(text, index + 1):
+                    found[key] = self.keywords[key]
+        return list(found.values())
+
+    def longest_match(self, text: str) -> Optional[str]:
+        """Returns the longest keyword found as a whole word in text, or None."""
+        return max(self.find_all(text), key=len, default=None)
@@ -0,0 +1,158 @@
+import os
+import json
+import base64
+import asyncio
+import logging
+from typing import Dict, Optional
+from pyrogram import Client, raw
+from pyrogram.session import Session, Auth
+from pyrogram.errors import AuthBytesInvalid
+from info import MEDIA_SESSION_DIR, MEDIA_SESSION_CHECK_INTERVAL
+from main.bot import multi_clients
+
+TELEGRAM_DCS = (1, 2, 3, 4, 5)
+
+_session_locks: Dict[tuple, asyncio.Lock] = {}
+
+
+def _auth_key_file(user_id: int) -> str:
+    return os.path.join(MEDIA_SESSION_DIR, f"{user_id}.json")
+
+def load_auth_keys(user_id: int) -> Dict[int, bytes]:
+    """Returns the exported auth keys saved for a bot, by DC."""
+    try:
+        with open(_auth_key_file(user_id)) as f:
+            return {int(dc_id): base64.b64decode(key) for dc_id, key in json.load(f).items()}
+    except (OSError, ValueError):
+        return {}
+
+def save_auth_key(user_id: int, dc_id: int, auth_key: Optional[bytes]) -> None:
+    """Saves (or with auth_key=None forgets) the exported auth key of a bot for a DC."""
+    keys = load_auth_keys(user_id)
+    if auth_key is None:
+        keys.pop(dc_id, None)
+    else:
+        keys[dc_id] = auth_key
+    os.makedirs(MEDIA_SESSION_DIR, exist_ok=True)
+    path = _auth_key_file(user_id)
+    fd = os.open(f"{path}.tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump({str(dc): base64.b64encode(key).decode() for dc, key in keys.items()}, f)
+    os.replace(f"{path}.tmp", path)
+
+
+async def _start_session(client: Client, dc_id: int, auth_key: bytes) -> Session:
+    media_session = Session(
+        client,
+        dc_id,
+        auth_key,
+        await client.storage.test_mode(),
+        is_media=True,
+    )
+    await media_session.start()
+    return media_session
+
+async def _restore_session(client: Client, dc_id: int) -> Optional[Session]:
+    """Starts a media session with a saved auth key, if there is one and it is still valid."""
+    user_id = await client.storage.user_id()
+    auth_key = load_auth_keys(user_id).get(dc_id)
+    if auth_key is None:
+        return None
+    media_session = None
+    try:
+        media_session = await _start_session(client, dc_id, auth_key)
+        await media_session.send(raw.functions.updates.GetState())
+        logging.debug(f"Restored saved media session for DC {dc_id}")
+        return media_session
+    except Exception as e:
+        logging.info(f"Saved auth key for DC {dc_id} is no longer valid: {e}")
+        if media_session is not None:
+            await media_session.stop()
+        save_auth_key(user_id, dc_id, None)
+        return None
+
+async def _export_session(client: Client, dc_id: int) -> Session:
+    """Creates a new auth key on dc_id and imports the client's authorization into it."""
+    media_session = await _start_session(
+        client,
+        dc_id,
+        await Auth(client, dc_id, await client.storage.test_mode()).create(),
+    )
+    for _ in range(6):
+        exported_auth = await client.invoke(
+            raw.functions.auth.ExportAuthorization(dc_id=dc_id)
+        )
+
+        try:
+            await media_session.send(
+                raw.functions.auth.ImportAuthorization(
+                    id=exported_auth.id, bytes=exported_auth.bytes
+                )
+            )
+            break
+        except AuthBytesInvalid:
+            logging.debug(f"Invalid authorization bytes for DC {dc_id}")
+            continue
+    else:
+        await media_session.stop()
+        raise AuthBytesInvalid
+    save_auth_key(await client.storage.user_id(), dc_id, media_session.auth_key)
+    return media_session
+
+
+async def get_media_session(client: Client, dc_id: int) -> Session:
+    """
+    Returns the media session of a client for dc_id, creating it if needed.
+    A saved auth key is reused before falling back to a new ExportAuthorization handshake.
+    """
+    media_session = client.media_sessions.get(dc_id, None)
+    if media_session is not None:
+        logging.debug(f"Using cached media session for DC {dc_id}")
+        return media_session
+
+    lock = _session_locks.setdefault((id(client), dc_id), asyncio.Lock())
+    async with lock:
+        media_session = client.media_sessions.get(dc_id, None)
+        if media_session is not None:
+            return media_session
+        if dc_id != await client.storage.dc_id():
+            media_session = await _restore_session(client, dc_id) or await _export_session(client, dc_id)
+        else:
+            media_session = await _start_session(client, dc_id, await client.storage.auth_key())
+        logging.debug(f"Created media session for DC {dc_id}")
+        client.media_sessions[dc_id] = media_session
+    return media_session
+
+
+async def warm_media_sessions() -> None:
+    """Opens the media sessions of every client for every DC in the background."""
+    async def warm_client(index: int, client: Client):
+        for dc_id in TELEGRAM_DCS:
+            try:
+                await get_media_session(client, dc_id)
+            except Exception as e:
+                logging.warning(f"Couldn't pre-warm media session for DC {dc_id} on client {index}: {e}")
+        logging.info(f"Pre-warmed media sessions for client {index}")
+
+    await asyncio.gather(*[warm_client(index, client) for index, client in list(multi_clients.items())])
+
+
+async def check_media_sessions() -> None:
+    """Pings every open media session periodically and replaces the ones that stopped answering."""
+    while True:
+        await asyncio.sleep(MEDIA_SESSION_CHECK_INTERVAL)
+        for index, client in list(multi_clients.items()):
+            for dc_id, media_session in list(client.media_sessions.items()):
+                try:
+                    await asyncio.wait_for(media_session.send(raw.functions.Ping(ping_id=0)), 15)
+                except Exception as e:
+                    logging.warning(f"Media session for DC {dc_id} on client {index} is unhealthy: {e}")
+                    client.media_sessions.pop(dc_id, None)
+                    try:
+                        await media_session.stop()
+                    except Exception:
+                        pass
+                    try:
+                        await get_media_session(client, dc_id)
+                    except Exception as e:
+                        logging.warning(f"Couldn't recreate media session for DC {dc_id} on client {index}: {e}")
@@ -0,0 +1,148 @@
+from array import array
+from bisect import bisect_left
+from typing import Callable, Iterable, List
+
+# Every counter lives in a fixed size array allocated at import, recording a sample
+# is a couple of index operations and never creates objects per request.
+MAX_CLIENTS = 64
+MAX_DC = 5
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATUS_CODES = (200, 206, 304, 400, 403, 404, 416, 429, 500)
+CACHES = ("file_properties", "rendered_page")
+
+_status_index = {status: i for i, status in enumerate(STATUS_CODES)}
+_cache_index = {name: i for i, name in enumerate(CACHES)}
+_buckets = len(LATENCY_BUCKETS) + 1
+
+bytes_served = array("Q", [0] * MAX_CLIENTS)
+streams_total = array("Q", [0] * MAX_CLIENTS)
+streams_aborted = array("Q", [0] * MAX_CLIENTS)
+wasted_bytes = array("Q", [0] * MAX_CLIENTS)
+get_file_buckets = array("Q", [0] * (_buckets * (MAX_DC + 1)))
+get_file_sum = array("d", [0.0] * (MAX_DC + 1))
+get_file_count = array("Q", [0] * (MAX_DC + 1))
+ttfb_buckets = array("Q", [0] * _buckets)
+ttfb_sum = array("d", [0.0])
+responses = array("Q", [0] * (len(STATUS_CODES) + 1))
+cache_hits = array("Q", [0] * len(CACHES))
+cache_misses = array("Q", [0] * len(CACHES))
+
+# Stats owned by other modules (database caches, pools, writers) are added by the module itself
+# with register_collector, so this module doesn't import them.
+_collectors: List[Callable[[], Iterable[str]]] = []
+
+
+def _client_slot(index: int) -> int:
+    return index if 0 <= index < MAX_CLIENTS else MAX_CLIENTS - 1
+
+def observe_get_file(dc_id: int, seconds: float) -> None:
+    dc = dc_id if 0 < dc_id <= MAX_DC else 0
+    get_file_buckets[dc * _buckets + bisect_left(LATENCY_BUCKETS, seconds)] += 1
+    get_file_sum[dc] += seconds
+    get_file_count[dc] += 1
+
+def observe_ttfb(seconds: float) -> None:
+    ttfb_buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+    ttfb_sum[0] += seconds
+
+def add_bytes(index: int, nbytes: int) -> None:
+    bytes_served[_client_slot(index)] += nbytes
+
+def stream_started(index: int) -> None:
+    streams_total[_client_slot(index)] += 1
+
+def stream_aborted(index: int, wasted: int) -> None:
+    """Records a stream the client dropped, wasted is what was fetched but never sent."""
+    streams_aborted[_client_slot(index)] += 1
+    wasted_bytes[_client_slot(index)] += max(wasted, 0)
+
+def count_response(status: int) -> None:
+    responses[_status_index.get(status, len(STATUS_CODES))] += 1
+
+def cache_hit(name: str) -> None:
+    cache_hits[_cache_index[name]] += 1
+
+def cache_miss(name: str) -> None:
+    cache_misses[_cache_index[name]] += 1
+
+
+def register_collector(collect: Callable[[], Iterable[str]]) -> Callable[[], Iterable[str]]:
+    """Adds a function returning exposition lines to every render, usable as a decorator."""
+    _collectors.append(collect)
+    return collect
+
+
+def _histogram(lines, name, labels, counts, offset, total_sum):
+    cumulative = 0
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        cumulative += counts[offset + i]
+        lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+    cumulative += counts[offset + len(LATENCY_BUCKETS)]
+    lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {cumulative}')
+    labels = labels.rstrip(",")
+    labels = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{labels} {total_sum}")
+    lines.append(f"{name}_count{labels} {cumulative}")
+
+def render() -> str:
+    """Returns all metrics in the Prometheus text exposition format."""
+    # main.bot imports the database modules, which register their collectors here at import.
+    from main.bot import work_loads
+
+    lines = []
+    clients = sorted(work_loads)
+
+    lines.append("# HELP stream_active_streams Streams currently served by each client.")
+    lines.append("# TYPE stream_active_streams gauge")
+    for index in clients:
+        lines.append(f'stream_active_streams{{client="{index}"}} {work_loads[index]}')
+
+    lines.append("# HELP stream_streams_total Streams started by each client.")
+    lines.append("# TYPE stream_streams_total counter")
+    for index in clients:
+        lines.append(f'stream_streams_total{{client="{index}"}} {streams_total[_client_slot(index)]}')
+
+    lines.append("# HELP stream_bytes_served_total Bytes sent to viewers by each client.")
+    lines.append("# TYPE stream_bytes_served_total counter")
+    for index in clients:
+        lines.append(f'stream_bytes_served_total{{client="{index}"}} {bytes_served[_client_slot(index)]}')
+
+    lines.append("# HELP stream_aborted_total Streams the client disconnected from before the end.")
+    lines.append("# TYPE stream_aborted_total counter")
+    for index in clients:
+        lines.append(f'stream_aborted_total{{client="{index}"}} {streams_aborted[_client_slot(index)]}')
+
+    lines.append("# HELP stream_wasted_bytes_total Bytes fetched from telegram for streams that were aborted before sending them.")
+    lines.append("# TYPE stream_wasted_bytes_total counter")
+    for index in clients:
+        lines.append(f'stream_wasted_bytes_total{{client="{index}"}} {wasted_bytes[_client_slot(index)]}')
+
+    lines.append("# HELP stream_getfile_seconds Latency of upload.GetFile calls per DC.")
+    lines.append("# TYPE stream_getfile_seconds histogram")
+    for dc in range(MAX_DC + 1):
+        if get_file_count[dc]:
+            _histogram(lines, "stream_getfile_seconds", f'dc="{dc}",', get_file_buckets, dc * _buckets, get_file_sum[dc])
+
+    lines.append("# HELP stream_ttfb_seconds Time from request to the first byte of the body.")
+    lines.append("# TYPE stream_ttfb_seconds histogram")
+    _histogram(lines, "stream_ttfb_seconds", "", ttfb_buckets, 0, ttfb_sum[0])
+
+    lines.append("# HELP stream_responses_total Responses of the web server by status code.")
+    lines.append("# TYPE stream_responses_total counter")
+    for i, status in enumerate(STATUS_CODES):
+        lines.append(f'stream_responses_total{{code="{status}"}} {responses[i]}')
+    lines.append(f'stream_responses_total{{code="other"}} {responses[len(STATUS_CODES)]}')
+
+    lines.append("# HELP stream_cache_hits_total Cache hits by cache.")
+    lines.append("# TYPE stream_cache_hits_total counter")
+    for i, name in enumerate(CACHES):
+        lines.append(f'stream_cache_hits_total{{cache="{name}"}} {cache_hits[i]}')
+    lines.append("# HELP stream_cache_misses_total Cache misses by cache.")
+    lines.append("# TYPE stream_cache_misses_total counter")
+    for i, name in enumerate(CACHES):
+        lines.append(f'stream_cache_misses_total{{cache="{name}"}} {cache_misses[i]}')
+
+    for collect in _collectors:
+        lines.extend(collect())
+
+    return "\n".join(lines) + "\n"
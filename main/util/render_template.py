@@ -1,45 +1,60 @@
 import jinja2
 from info import *
 from main.bot import MainBot
+from main.util import metrics
+from main.util.cache import TTLCache
 from main.util.human_readable import humanbytes
 from main.util.file_properties import get_file_ids
 from main.server.exceptions import InvalidHash
 import urllib.parse
 import logging
-import aiohttp
 
+# Templates are compiled once at import, the bytecode cache lets restarts skip the compile too.
+template_env = jinja2.Environment(
+    loader=jinja2.FileSystemLoader("main/template"),
+    bytecode_cache=jinja2.FileSystemBytecodeCache(),
+    auto_reload=False,
+)
+stream_template = template_env.get_template("req.html")
+download_template = template_env.get_template("dl.html")
 
-async def render_page(id, secure_hash, src=None):
-    file = await MainBot.get_messages(int(LOG_CHANNEL), int(id))
-    file_data = await get_file_ids(MainBot, int(LOG_CHANNEL), int(id))
-    if file_data.unique_id[:6] != secure_hash:
-        logging.debug(f"link hash: {secure_hash} - {file_data.unique_id[:6]}")
-        logging.debug(f"Invalid hash for message with - ID {id}")
-        raise InvalidHash
+rendered_pages = TTLCache(maxsize=512, ttl=30 * 60)
 
-    src = urllib.parse.urljoin(
-        URL,
-        f"{id}/{urllib.parse.quote_plus(file_data.file_name)}?hash={secure_hash}",
-    )
+
+async def render_page(id, secure_hash, src=None, file_data=None):
+    cache_key = (id, secure_hash, src)
+    page = rendered_pages.get(cache_key)
+    if page is not None:
+        metrics.cache_hit("rendered_page")
+        return page
+    metrics.cache_miss("rendered_page")
+
+    if file_data is None:
+        file_data = await get_file_ids(MainBot, int(LOG_CHANNEL), int(id))
+        if file_data.unique_id[:6] != secure_hash:
+            logging.debug(f"link hash: {secure_hash} - {file_data.unique_id[:6]}")
+            logging.debug(f"Invalid hash for message with - ID {id}")
+            raise InvalidHash
+
+    if src is None:
+        src = urllib.parse.urljoin(
+            URL,
+            f"{id}/{urllib.parse.quote_plus(file_data.file_name)}?hash={secure_hash}",
+        )
 
     tag = file_data.mime_type.split("/")[0].strip()
-    file_size = humanbytes(file_data.file_size)
     if tag in ["video", "audio"]:
-        template_file = "main/template/req.html"
+        template = stream_template
     else:
-        template_file = "main/template/dl.html"
-        async with aiohttp.ClientSession() as s:
-            async with s.get(src) as u:
-                file_size = humanbytes(int(u.headers.get("Content-Length")))
-
-    with open(template_file) as f:
-        template = jinja2.Template(f.read())
+        template = download_template
 
     file_name = file_data.file_name.replace("_", " ")
 
-    return template.render(
+    page = template.render(
         file_name=file_name,
         file_url=src,
-        file_size=file_size,
+        file_size=humanbytes(file_data.file_size),
         file_unique_id=file_data.unique_id,
     )
+    rendered_pages.set(cache_key, page)
+    return page
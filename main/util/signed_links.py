@@ -0,0 +1,151 @@
+import hmac
+import time
+import base64
+import struct
+import hashlib
+import logging
+from typing import Tuple
+from urllib.parse import quote_plus
+from pyrogram import Client
+from pyrogram.types import Message
+from pyrogram.file_id import FileId, FileType
+from info import URL, LOG_CHANNEL, BOT_TOKEN, STREAM_SECRET, SIGNED_LINKS, SIGNED_LINK_EXPIRY
+from database.log_copies import log_copies, describe, get_unique_id
+from main.server.exceptions import InvalidHash, LinkExpired
+
+TOKEN_VERSION = 1
+MAC_SIZE = 12
+# Longer file names are cut, in the token and in the path, so a message with both links stays
+# well under telegram's 4096 characters even for names that quote_plus triples.
+MAX_NAME_BYTES = 128
+
+# version, file_type, dc_id, media_id, access_hash, file_size, message_id, date, expires, user_id
+_HEADER = struct.Struct("<BBBqqQiIIq")
+_LENGTH = struct.Struct("<H")
+_SECRET = hashlib.sha256((STREAM_SECRET or BOT_TOKEN).encode()).digest()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def _sign(payload: bytes) -> bytes:
+    return hmac.new(_SECRET, payload, hashlib.sha256).digest()[:MAC_SIZE]
+
+def _short_name(file_name: str) -> str:
+    return (file_name or "").encode()[:MAX_NAME_BYTES].decode(errors="ignore")
+
+def _pack_fields(*fields: bytes) -> bytes:
+    return b"".join(_LENGTH.pack(len(field)) + field for field in fields)
+
+def _unpack_fields(data: bytes, count: int):
+    fields, offset = [], 0
+    for _ in range(count):
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        fields.append(data[offset:offset + length])
+        offset += length
+    return fields
+
+
+def sign_copy(copy: dict, user_id: int = 0, expires_in: int = SIGNED_LINK_EXPIRY) -> str:
+    """
+    Builds a signed token for a file copied to the log channel, see database.log_copies.describe.
+    The token holds everything the stream server needs to locate the file on telegram,
+    so it can be served without calling get_messages, and the user the link was made for.
+    """
+    file_id = FileId.decode(copy["file_id"])
+    expires = int(time.time()) + expires_in if expires_in else 0
+    payload = _HEADER.pack(
+        TOKEN_VERSION,
+        int(file_id.file_type),
+        file_id.dc_id,
+        file_id.media_id,
+        file_id.access_hash,
+        copy["file_size"],
+        copy["msg_id"],
+        copy["date"],
+        expires,
+        user_id or 0,
+    ) + _pack_fields(
+        file_id.file_reference or b"",
+        (file_id.thumbnail_size or "").encode(),
+        copy["mime_type"].encode(),
+        _short_name(copy["file_name"]).encode(),
+        (copy.get("unique_id") or copy["_id"]).encode(),
+    )
+    return _b64encode(payload + _sign(payload))
+
+
+def sign_media(message: Message, user_id: int = 0, expires_in: int = SIGNED_LINK_EXPIRY) -> str:
+    """Builds a signed token for the media of a log channel message."""
+    return sign_copy(describe(message), user_id, expires_in)
+
+
+def decode_token(token: str) -> FileId:
+    """
+    Validates a signed token and returns the FileId stored in it.
+    The returned FileId carries the same extra attributes as get_file_ids.
+    """
+    try:
+        data = _b64decode(token)
+    except (ValueError, TypeError):
+        raise InvalidHash
+    payload, mac = data[:-MAC_SIZE], data[-MAC_SIZE:]
+    if len(payload) < _HEADER.size or payload[0] != TOKEN_VERSION or not hmac.compare_digest(mac, _sign(payload)):
+        logging.debug("Invalid signature for stream token")
+        raise InvalidHash
+    (version, file_type, dc_id, media_id, access_hash,
+     file_size, message_id, date, expires, user_id) = _HEADER.unpack_from(payload)
+    if expires and expires < time.time():
+        raise LinkExpired
+    file_reference, thumbnail_size, mime_type, file_name, unique_id = _unpack_fields(payload[_HEADER.size:], 5)
+
+    file_id = FileId(
+        file_type=FileType(file_type),
+        dc_id=dc_id,
+        media_id=media_id,
+        access_hash=access_hash,
+        file_reference=file_reference,
+        thumbnail_size=thumbnail_size.decode(),
+    )
+    setattr(file_id, "file_size", file_size)
+    setattr(file_id, "mime_type", mime_type.decode())
+    setattr(file_id, "file_name", file_name.decode(errors="ignore"))
+    setattr(file_id, "unique_id", unique_id.decode())
+    setattr(file_id, "message_id", message_id)
+    setattr(file_id, "date", date)
+    setattr(file_id, "expires", expires)
+    setattr(file_id, "user_id", user_id)
+    return file_id
+
+
+def signed_url(token: str, file_name: str, watch: bool = False) -> str:
+    return f"{URL}{'watch/' if watch else ''}s/{token}/{quote_plus(_short_name(file_name))}"
+
+
+def copy_stream_links(copy: dict, user_id: int = 0) -> Tuple[str, str]:
+    """Returns the (stream, download) links made for user_id, for a file copied to the log channel."""
+    file_name = _short_name(copy["file_name"])
+    if SIGNED_LINKS:
+        token = sign_copy(copy, user_id)
+        return signed_url(token, file_name, watch=True), signed_url(token, file_name)
+    stream = f"{URL}watch/{copy['msg_id']}/{quote_plus(file_name)}?hash={copy['hash']}"
+    download = f"{URL}{copy['msg_id']}/{quote_plus(file_name)}?hash={copy['hash']}"
+    return stream, download
+
+
+def get_stream_links(log_msg: Message, user_id: int = 0) -> Tuple[str, str]:
+    """Returns the (stream, download) links made for user_id, for a media message in the log channel."""
+    return copy_stream_links(describe(log_msg), user_id)
+
+
+async def get_log_copy(client: Client, file_id: str) -> dict:
+    """Returns the log channel copy of a file, it is forwarded there only the first time."""
+    copy = await log_copies.get(get_unique_id(file_id))
+    if copy is None:
+        log_msg = await client.send_cached_media(chat_id=LOG_CHANNEL, file_id=file_id)
+        copy = await log_copies.save(log_msg)
+    return copy
@@ -0,0 +1,109 @@
+import time
+from collections import deque
+from typing import Deque, Dict, Hashable, List, Optional, Tuple
+
+
+class SpaceSaving:
+    def __init__(self, capacity: int = 200):
+        """Approximate most frequent keys of a stream in capacity counters (Space-Saving).
+        A new key arriving when every counter is taken replaces the smallest one and inherits
+        its count, which is kept as the error bound of the new key. Any key seen more than
+        total / capacity times is guaranteed to have a counter.
+        """
+        self.capacity = capacity
+        self.counters: Dict[Hashable, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.counters)
+
+    def add(self, key: Hashable, count: int = 1) -> None:
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += count
+            return
+        if len(self.counters) < self.capacity:
+            self.counters[key] = [count, 0]
+            return
+        # A full scan, only paid by keys that are not tracked yet once every counter is taken.
+        smallest = min(self.counters, key=lambda tracked: self.counters[tracked][0])
+        floor = self.counters.pop(smallest)[0]
+        self.counters[key] = [floor + count, floor]
+
+    def top(self, n: int) -> List[Tuple[Hashable, int, int]]:
+        """Returns up to n (key, count, error) by count, the true count is between count - error and count."""
+        ranked = sorted(self.counters.items(), key=lambda item: item[1][0], reverse=True)
+        return [(key, count, error) for key, (count, error) in ranked[:n]]
+
+
+class WindowedTopK:
+    def __init__(self, capacity: int = 200, window: int = 3600, windows: int = 168):
+        """One SpaceSaving per window of window seconds, the last windows of them are kept.
+        Queries sum the summaries of the windows they cover, so the top keys of the last hour,
+        day or week come from memory. to_document / load_document save it to MongoDB.
+        """
+        self.capacity = capacity
+        self.window = window
+        self.windows = windows
+        self.summaries: Deque[Tuple[int, SpaceSaving]] = deque()
+
+    def _summary(self, now: float) -> SpaceSaving:
+        start = int(now // self.window * self.window)
+        if not self.summaries or self.summaries[-1][0] < start:
+            self.summaries.append((start, SpaceSaving(self.capacity)))
+        while self.summaries[0][0] <= start - self.window * self.windows:
+            self.summaries.popleft()
+        return self.summaries[-1][1]
+
+    def add(self, key: Hashable, count: int = 1, now: Optional[float] = None) -> None:
+        self._summary(time.time() if now is None else now).add(key, count)
+
+    def counts(self, since: float, until: Optional[float] = None) -> Dict[Hashable, int]:
+        """Sums the counts of the windows starting in [since, until), since is rounded down to a window."""
+        since = since // self.window * self.window
+        totals: Dict[Hashable, int] = {}
+        for start, summary in self.summaries:
+            if start < since or (until is not None and start >= until):
+                continue
+            for key, (count, _) in summary.counters.items():
+                totals[key] = totals.get(key, 0) + count
+        return totals
+
+    def top(self, n: int = 10, hours: int = 24, now: Optional[float] = None) -> List[Tuple[Hashable, int]]:
+        """Returns up to n (key, count) of the last hours by count."""
+        now = time.time() if now is None else now
+        totals = self.counts(now - hours * 3600)
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:n]
+
+    def covers(self, hours: int, now: Optional[float] = None) -> bool:
+        """True if windows of the last hours were kept, e.g. the bot wasn't restarted without a snapshot."""
+        if not self.summaries or hours * 3600 > self.window * self.windows:
+            return False
+        now = time.time() if now is None else now
+        return self.summaries[0][0] <= (now - hours * 3600) // self.window * self.window
+
+    def to_document(self) -> dict:
+        return {
+            "window": self.window,
+            "summaries": [
+                {"start": start, "counters": [[key, count, error] for key, (count, error) in summary.counters.items()]}
+                for start, summary in self.summaries
+            ],
+        }
+
+    def load_document(self, document: dict, now: Optional[float] = None) -> None:
+        """Restores a snapshot of to_document, windows counted since are kept and merged."""
+        if document.get("window") != self.window:
+            return
+        current = {start: summary for start, summary in self.summaries}
+        for saved in document.get("summaries", []):
+            summary = SpaceSaving(self.capacity)
+            for key, count, error in saved["counters"]:
+                summary.counters[key] = [count, error]
+            newer = current.get(saved["start"])
+            if newer is not None:
+                for key, (count, _) in newer.counters.items():
+                    summary.add(key, count)
+            current[saved["start"]] = summary
+        self.summaries = deque(sorted(current.items()))
+        if self.summaries:
+            self._summary(time.time() if now is None else now)
@@ -9,8 +9,7 @@ from database.join_reqs import JoinReqs
 from info import *
 from utils import get_settings, pub_is_subscribed, get_size, is_subscribed, save_group_settings, temp, verify_user, check_token, check_verification, get_token, get_shortlink, get_tutorial, get_seconds
 from database.connections_mdb import active_connection
-from urllib.parse import quote_plus
-from main.util.file_properties import get_name, get_hash, get_media_file_size
+from main.util.signed_links import get_log_copy, copy_stream_links
 logger = logging.getLogger(__name__)
 
 BATCH_FILES = {}
@@ -137,10 +136,8 @@ async def auto_approve(client, message: ChatJoinRequest):
                 f_caption = f"{title}"
             try:
                 if STREAM_MODE == True:
-                    log_msg = await client.send_cached_media(chat_id=LOG_CHANNEL, file_id=msg.get("file_id"))
-                    fileName = {quote_plus(get_name(log_msg))}
-                    stream = f"{URL}watch/{str(log_msg.id)}/{quote_plus(get_name(log_msg))}?hash={get_hash(log_msg)}"
-                    download = f"{URL}{str(log_msg.id)}/{quote_plus(get_name(log_msg))}?hash={get_hash(log_msg)}"
+                    log_copy = await get_log_copy(client, msg.get("file_id"))
+                    stream, download = copy_stream_links(log_copy, message.from_user.id)
 
                 if STREAM_MODE == True:
                     button = [[
@@ -209,10 +206,8 @@ async def auto_approve(client, message: ChatJoinRequest):
                         f_caption = getattr(msg, 'caption', '')
                 file_id = file.file_id
                 if STREAM_MODE == True:
-                    log_msg = await client.send_cached_media(chat_id=LOG_CHANNEL, file_id=file_id)
-                    fileName = {quote_plus(get_name(log_msg))}
-                    stream = f"{URL}watch/{str(log_msg.id)}/{quote_plus(get_name(log_msg))}?hash={get_hash(log_msg)}"
-                    download = f"{URL}{str(log_msg.id)}/{quote_plus(get_name(log_msg))}?hash={get_hash(log_msg)}"
+                    log_copy = await get_log_copy(client, file_id)
+                    stream, download = copy_stream_links(log_copy, message.from_user.id)
  
                 if STREAM_MODE == True:
                     button = [[
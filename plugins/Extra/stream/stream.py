@@ -1,8 +1,9 @@
 from pyrogram import Client, filters, enums
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, ForceReply, CallbackQuery
-from info import STREAM_MODE, URL, LOG_CHANNEL
+from info import STREAM_MODE, LOG_CHANNEL
 from urllib.parse import quote_plus
-from main.util.file_properties import get_name, get_hash, get_media_file_size
+from main.util.file_properties import get_media_file_size
+from main.util.signed_links import get_log_copy, copy_stream_links
 from main.util.human_readable import humanbytes
 import humanize
 import random
@@ -22,17 +23,14 @@ async def stream_start(client, message):
         user_id = message.from_user.id
         username =  message.from_user.mention 
 
-        log_msg = await client.send_cached_media(
-            chat_id=LOG_CHANNEL,
-            file_id=fileid,
-        )
-        fileName = {quote_plus(get_name(log_msg))}
-        stream = f"{URL}watch/{str(log_msg.id)}/{quote_plus(get_name(log_msg))}?hash={get_hash(log_msg)}"
-        download = f"{URL}{str(log_msg.id)}/{quote_plus(get_name(log_msg))}?hash={get_hash(log_msg)}"
+        log_copy = await get_log_copy(client, fileid)
+        fileName = {quote_plus(log_copy["file_name"])}
+        stream, download = copy_stream_links(log_copy, user_id)
  
-        await log_msg.reply_text(
+        await client.send_message(
+            chat_id=LOG_CHANNEL,
             text=f"•• ʟɪɴᴋ ɢᴇɴᴇʀᴀᴛᴇᴅ ꜰᴏʀ ɪᴅ #{user_id} \n•• ᴜꜱᴇʀɴᴀᴍᴇ : {username} \n\n•• ᖴᎥᒪᗴ Nᗩᗰᗴ : {fileName}",
-            quote=True,
+            reply_to_message_id=log_copy["msg_id"],
             disable_web_page_preview=True,
             reply_markup=InlineKeyboardMarkup(
                 [[
@@ -49,4 +47,4 @@ async def stream_start(client, message):
         )
         msg_text = """<i><u>𝗬𝗼𝘂𝗿 𝗟𝗶𝗻𝗸 𝗚𝗲𝗻𝗲𝗿𝗮𝘁𝗲𝗱 !</u></i>\n\n<b>📂 Fɪʟᴇ ɴᴀᴍᴇ :</b> <i>{}</i>\n\n<b>📦 Fɪʟᴇ ꜱɪᴢᴇ :</b> <i>{}</i>\n\n<b>📥 Dᴏᴡɴʟᴏᴀᴅ :</b> <i>{}</i>\n\n<b> 🖥ᴡᴀᴛᴄʜ  :</b> <i>{}</i>\n\n<b>🚸 Nᴏᴛᴇ : ʟɪɴᴋ ᴡᴏɴ'ᴛ ᴇxᴘɪʀᴇ ᴛɪʟʟ ɪ ᴅᴇʟᴇᴛᴇ</b>"""
 
-        await message.reply_text(text=msg_text.format(get_name(log_msg), humanbytes(get_media_file_size(msg)), download, stream), quote=True, disable_web_page_preview=True, reply_markup=rm)
+        await message.reply_text(text=msg_text.format(log_copy["file_name"], humanbytes(get_media_file_size(msg)), download, stream), quote=True, disable_web_page_preview=True, reply_markup=rm)
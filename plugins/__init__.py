@@ -1,7 +1,7 @@
 from aiohttp import web
-from .route import routes, setup_routes
+from .route import routes, setup_routes, metrics_middleware
 
 async def web_server():
-    web_app = web.Application(client_max_size=30000000)
+    web_app = web.Application(client_max_size=30000000, middlewares=[metrics_middleware])
     web_app = setup_routes(web_app)
     return web_app
@@ -1,13 +1,15 @@
+import time
 import logging
 import asyncio
 from datetime import datetime, timedelta
 from aiohttp import web
 from pyrogram import Client, filters
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from info import ADMINS, DATABASE_NAME
+from info import ADMINS, DATABASE_NAME, DASHBOARD_CACHE_TTL, DASHBOARD_CACHE_STALE
 from database.users_chats_db import db
 from database.analytics import analytics_db
 from database.tiered_access import tiered_access
+from database.retention import storage_report, format_report
 from main.duplicate_detector import duplicate_detector
 from main.nlp_search import nlp_search
 from main.bot import MainBot
@@ -25,42 +27,75 @@ async def admin_auth_middleware(request, handler):
         return web.json_response({"error": "Unauthorized"}, status=401)
     return await handler(request)
 
+# The dashboard payload is shared by every request. It is served from memory for DASHBOARD_CACHE_TTL
+# seconds, then served stale while one background task rebuilds it, up to DASHBOARD_CACHE_STALE seconds.
+_dashboard = {"payload": None, "built_at": 0.0, "refresh": None}
+
+async def build_dashboard():
+    """Runs the dashboard queries concurrently and returns the payload"""
+    (
+        user_count,
+        chat_count,
+        active_users,
+        popular_files,
+        popular_searches,
+        hourly_stats,
+        tier_stats,
+    ) = await asyncio.gather(
+        db.total_users_count(),
+        db.total_chat_count(),
+        # Active users in last 7 days
+        analytics_db.get_most_active_users(days=7, limit=10),
+        analytics_db.get_most_accessed_files(days=7, limit=10),
+        analytics_db.get_popular_search_terms(days=7, limit=10),
+        analytics_db.get_hourly_usage_stats(days=1),
+        tiered_access.get_tier_stats(),
+    )
+    return {
+        "stats": {
+            "total_users": user_count,
+            "total_chats": chat_count,
+            "active_users": len(active_users)
+        },
+        "active_users": active_users,
+        "popular_files": popular_files,
+        "popular_searches": popular_searches,
+        "hourly_stats": hourly_stats,
+        "tier_stats": tier_stats
+    }
+
+async def _refresh_dashboard():
+    try:
+        _dashboard["payload"] = await build_dashboard()
+        _dashboard["built_at"] = time.monotonic()
+    finally:
+        _dashboard["refresh"] = None
+
+def _start_refresh():
+    if _dashboard["refresh"] is None:
+        _dashboard["refresh"] = asyncio.create_task(_refresh_dashboard())
+    return _dashboard["refresh"]
+
+def _log_refresh_error(task):
+    if not task.cancelled() and task.exception():
+        logger.error(f"Error refreshing admin dashboard: {task.exception()}")
+
+async def get_dashboard():
+    """Returns the cached payload, rebuilding it in the background once it is older than DASHBOARD_CACHE_TTL"""
+    age = time.monotonic() - _dashboard["built_at"]
+    if _dashboard["payload"] is None or age > DASHBOARD_CACHE_STALE:
+        # Nothing usable, every request waits for the same rebuild
+        await asyncio.shield(_start_refresh())
+    elif age > DASHBOARD_CACHE_TTL and _dashboard["refresh"] is None:
+        _start_refresh().add_done_callback(_log_refresh_error)
+    return _dashboard["payload"]
+
 # Dashboard routes
 @routes.get('/admin/dashboard', name='admin_dashboard')
 async def admin_dashboard(request):
     """Main admin dashboard page"""
     try:
-        # Get basic stats
-        user_count = await db.total_users_count()
-        chat_count = await db.total_chat_count()
-        
-        # Get active users in last 7 days
-        active_users = await analytics_db.get_most_active_users(days=7, limit=10)
-        
-        # Get popular files
-        popular_files = await analytics_db.get_most_accessed_files(days=7, limit=10)
-        
-        # Get popular search terms
-        popular_searches = await analytics_db.get_popular_search_terms(days=7, limit=10)
-        
-        # Get hourly usage stats
-        hourly_stats = await analytics_db.get_hourly_usage_stats(days=1)
-        
-        # Get tier stats
-        tier_stats = await tiered_access.get_tier_stats()
-        
-        return web.json_response({
-            "stats": {
-                "total_users": user_count,
-                "total_chats": chat_count,
-                "active_users": len(active_users)
-            },
-            "active_users": active_users,
-            "popular_files": popular_files,
-            "popular_searches": popular_searches,
-            "hourly_stats": hourly_stats,
-            "tier_stats": tier_stats
-        })
+        return web.json_response(await get_dashboard())
     except Exception as e:
         logger.error(f"Error in admin dashboard: {e}")
         return web.json_response({"error": str(e)}, status=500)
@@ -268,6 +303,16 @@ async def admin_delete_duplicate(request):
         logger.error(f"Error deleting duplicate: {e}")
         return web.json_response({"error": str(e)}, status=500)
 
+@routes.get('/admin/storage', name='admin_storage')
+async def admin_storage(request):
+    """Storage of the analytics and cache collections, and how much retention reclaimed since startup"""
+    try:
+        report = await asyncio.to_thread(storage_report)
+        return web.json_response({"collections": report})
+    except Exception as e:
+        logger.error(f"Error getting storage report: {e}")
+        return web.json_response({"error": str(e)}, status=500)
+
 # Telegram command handlers for admin dashboard
 @MainBot.on_message(filters.command("analytics") & filters.user(ADMINS))
 async def analytics_command(client, message):
@@ -280,8 +325,10 @@ async def analytics_command(client, message):
         # Get active users in last 7 days
         active_users = await analytics_db.get_most_active_users(days=7, limit=5)
         
-        # Get popular files
-        popular_files = await analytics_db.get_most_accessed_files(days=7, limit=5)
+        # Popular files and searches of the last day, from the in-memory trackers
+        popular_files = analytics_db.get_top("files", hours=24, limit=5)
+        popular_searches = analytics_db.get_top("queries", hours=24, limit=5)
+        zero_result_searches = analytics_db.get_top("zero_results", hours=24, limit=5)
         
         # Format message
         msg = f"📊 **Analytics Summary**\n\n"
@@ -292,9 +339,18 @@ async def analytics_command(client, message):
         for i, user in enumerate(active_users, 1):
             msg += f"{i}. User ID: {user['_id']} - {user['total_activity']} activities\n"
         
-        msg += "\n**Most Accessed Files (7 days)**\n"
-        for i, file in enumerate(popular_files, 1):
-            msg += f"{i}. File ID: {file['file_id']} - {file['access_count']} accesses\n"
+        msg += "\n**Most Accessed Files (24 hours)**\n"
+        for i, (file_id, count) in enumerate(popular_files, 1):
+            msg += f"{i}. File ID: {file_id} - {count} accesses\n"
+        
+        msg += "\n**Top Searches (24 hours)**\n"
+        for i, (query, count) in enumerate(popular_searches, 1):
+            msg += f"{i}. `{query}` - {count} searches\n"
+        
+        if zero_result_searches:
+            msg += "\n**Searches Without Results (24 hours)**\n"
+            for i, (query, count) in enumerate(zero_result_searches, 1):
+                msg += f"{i}. `{query}` - {count} searches\n"
             
         # Create keyboard for more options
         keyboard = InlineKeyboardMarkup([
@@ -313,6 +369,16 @@ async def analytics_command(client, message):
         logger.error(f"Error in analytics command: {e}")
         await message.reply(f"Error: {str(e)}")
 
+@MainBot.on_message(filters.command("storage") & filters.user(ADMINS))
+async def storage_command(client, message):
+    """Show storage reclaimed per collection"""
+    try:
+        report = await asyncio.to_thread(storage_report)
+        await message.reply(f"💾 **Storage since startup**\n\n```\n{format_report(report)}\n```")
+    except Exception as e:
+        logger.error(f"Error in storage command: {e}")
+        await message.reply(f"Error: {str(e)}")
+
 @MainBot.on_message(filters.command("duplicates") & filters.user(ADMINS))
 async def duplicates_command(client, message):
     """Show duplicate files"""
@@ -154,47 +154,8 @@ class ContentRecommender:
         
     async def get_trending_content(self, days=3, limit=10):
         """Get trending content (highest growth in popularity)"""
-        # Get current popular content
-        current_popular = await self.analytics_db.get_most_accessed_files(days=days, limit=50)
-        
-        # Get previous period popular content
-        previous_cutoff = datetime.now() - timedelta(days=days*2)
-        cutoff_date = datetime.now() - timedelta(days=days)
-        
-        # Aggregate previous period stats
-        pipeline = [
-            {
-                "$match": {
-                    "activity_type": "file_access",
-                    "timestamp": {"$gt": previous_cutoff, "$lt": cutoff_date}
-                }
-            },
-            {
-                "$group": {
-                    "_id": "$file_id",
-                    "access_count": {"$sum": 1},
-                    "unique_users": {"$addToSet": "$user_id"}
-                }
-            },
-            {
-                "$project": {
-                    "file_id": "$_id",
-                    "access_count": 1,
-                    "unique_user_count": {"$size": "$unique_users"}
-                }
-            },
-            {
-                "$sort": {"access_count": -1}
-            },
-            {
-                "$limit": 50
-            }
-        ]
-        
-        previous_popular = await self.analytics_db.analytics.aggregate(pipeline).to_list(length=50)
-        
-        # Create a map of previous counts
-        previous_counts = {item["file_id"]: item["access_count"] for item in previous_popular}
+        # Get current popular content and the counts of the previous period
+        current_popular, previous_counts = await self.analytics_db.get_file_access_trend(days=days, limit=50)
         
         # Calculate growth rate
         trending = []
@@ -1,13 +1,20 @@
-import re, math, logging, secrets, mimetypes, time
+import re, asyncio, logging, secrets, mimetypes, time
+from email.utils import formatdate, parsedate_to_datetime
 from info import *
 from aiohttp import web
 from aiohttp.http_exceptions import BadStatusLine
-from main.bot import multi_clients, work_loads, MainBot
-from main.server.exceptions import FIleNotFound, InvalidHash
+from pyrogram.file_id import FileId
+from main.bot import multi_clients, MainBot
+from main.server.exceptions import FIleNotFound, InvalidHash, LinkExpired
 from main import StartTime, __version__
 from main.util.custom_dl import ByteStreamer
+from main.util.client_scheduler import client_scheduler
+from main.util.fair_share import fair_share, get_user_tier_name
+from main.util import metrics
 from main.util.time_format import get_readable_time
 from main.util.render_template import render_page
+from main.util.signed_links import decode_token, signed_url
+from database.log_copies import log_copies, get_unique_id
 from plugins.admin_dashboard import setup_admin_routes
 
 routes = web.RouteTableDef()
@@ -20,6 +27,60 @@ async def root_route_handler(request):
 async def favicon_handler(request):
     raise web.HTTPNotFound()
 
+@routes.get("/metrics", allow_head=True)
+async def metrics_handler(request):
+    # Disabled unless METRICS_TOKEN is set, scrapers send it as a bearer token.
+    if not METRICS_TOKEN:
+        raise web.HTTPNotFound()
+    if not secrets.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        raise web.HTTPUnauthorized(headers={"WWW-Authenticate": "Bearer"})
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    try:
+        response = await handler(request)
+    except web.HTTPException as e:
+        metrics.count_response(e.status)
+        raise
+    except Exception:
+        metrics.count_response(500)
+        raise
+    metrics.count_response(response.status if response is not None else 500)
+    return response
+
+@routes.get(r"/watch/s/{token}/{name:.*}", allow_head=True)
+async def signed_watch_handler(request: web.Request):
+    try:
+        token = request.match_info["token"]
+        file_id = decode_token(token)
+        src = signed_url(token, file_id.file_name)
+        return web.Response(text=await render_page(file_id.message_id, None, src=src, file_data=file_id), content_type='text/html')
+    except (InvalidHash, LinkExpired) as e:
+        raise web.HTTPForbidden(text=e.message)
+    except (AttributeError, BadStatusLine, ConnectionResetError):
+        pass
+    except Exception as e:
+        logging.critical(e.with_traceback(None))
+        raise web.HTTPInternalServerError(text=str(e))
+
+@routes.get(r"/s/{token}/{name:.*}", allow_head=True)
+async def signed_stream_handler(request: web.Request):
+    try:
+        file_id = decode_token(request.match_info["token"])
+        return await media_streamer(request, file_id.message_id, None, file_id=file_id)
+    except (InvalidHash, LinkExpired) as e:
+        raise web.HTTPForbidden(text=e.message)
+    except FIleNotFound as e:
+        # The log channel message is gone, the next link for this file forwards it again.
+        await log_copies.forget(get_unique_id(file_id.encode()))
+        raise web.HTTPNotFound(text=e.message)
+    except (AttributeError, BadStatusLine, ConnectionResetError):
+        pass
+    except Exception as e:
+        logging.critical(e.with_traceback(None))
+        raise web.HTTPInternalServerError(text=str(e))
+
 @routes.get(r"/watch/{path:\S+}", allow_head=True)
 async def stream_handler(request: web.Request):
     try:
@@ -31,10 +92,17 @@ async def stream_handler(request: web.Request):
         else:
             id = int(re.search(r"(\d+)(?:\/\S+)?", path).group(1))
             secure_hash = request.rel_url.query.get("hash")
-        return web.Response(text=await render_page(id, secure_hash), content_type='text/html')
+        tg_connect = get_streamer(client_scheduler.pick(cached_dc_id(id)))
+        file_data = await tg_connect.get_file_properties(id)
+        if file_data.unique_id[:6] != secure_hash:
+            logging.debug(f"Invalid hash for message with ID {id}")
+            raise InvalidHash
+        return web.Response(text=await render_page(id, secure_hash, file_data=file_data), content_type='text/html')
     except InvalidHash as e:
         raise web.HTTPForbidden(text=e.message)
     except FIleNotFound as e:
+        # The log channel message is gone, the next link for this file forwards it again.
+        await log_copies.forget_message(id)
         raise web.HTTPNotFound(text=e.message)
     except (AttributeError, BadStatusLine, ConnectionResetError):
         pass
@@ -57,6 +125,8 @@ async def stream_handler(request: web.Request):
     except InvalidHash as e:
         raise web.HTTPForbidden(text=e.message)
     except FIleNotFound as e:
+        # The log channel message is gone, the next link for this file forwards it again.
+        await log_copies.forget_message(id)
         raise web.HTTPNotFound(text=e.message)
     except (AttributeError, BadStatusLine, ConnectionResetError):
         pass
@@ -66,60 +136,76 @@ async def stream_handler(request: web.Request):
 
 class_cache = {}
 
-async def media_streamer(request: web.Request, id: int, secure_hash: str):
+def get_streamer(index: int) -> ByteStreamer:
+    """Returns the ByteStreamer of a client, it holds the client's cached file properties."""
+    faster_client = multi_clients[index]
+    if faster_client in class_cache:
+        logging.debug(f"Using cached ByteStreamer object for client {index}")
+        return class_cache[faster_client]
+    logging.debug(f"Creating new ByteStreamer object for client {index}")
+    tg_connect = ByteStreamer(faster_client)
+    class_cache[faster_client] = tg_connect
+    return tg_connect
+
+def cached_dc_id(id: int):
+    """Returns the DC of a message's file if any client already resolved it."""
+    for tg_connect in class_cache.values():
+        file_id = tg_connect.cached_file_ids.get(id)
+        if file_id:
+            return file_id.dc_id
+    return None
+
+async def send_stream(request: web.Request, response: web.StreamResponse, body, index: int, started: float):
+    """
+    Writes the body to the client chunk by chunk.
+    The response is tied to the transport: a disconnect cancels the handler or fails the write,
+    which stops the generator at its pending GetFile and frees the client slot right away.
+    """
+    fetched = sent = 0
+    try:
+        await response.prepare(request)
+        async for chunk in body:
+            if not fetched:
+                metrics.observe_ttfb(time.monotonic() - started)
+            fetched += len(chunk)
+            await response.write(chunk)
+            sent += len(chunk)
+    except ConnectionResetError:
+        logging.debug(f"Client {request.remote} went away after {sent} bytes")
+        metrics.stream_aborted(index, fetched - sent)
+        return response
+    except asyncio.CancelledError:
+        logging.debug(f"Stream for {request.remote} cancelled after {sent} bytes")
+        metrics.stream_aborted(index, fetched - sent)
+        raise
+    finally:
+        await body.aclose()
+    await response.write_eof()
+    return response
+
+async def media_streamer(request: web.Request, id: int, secure_hash: str, file_id: FileId = None):
+    started = time.monotonic()
     range_header = request.headers.get("Range", 0)
     
-    index = min(work_loads, key=work_loads.get)
-    faster_client = multi_clients[index]
+    index = client_scheduler.pick(file_id.dc_id if file_id else cached_dc_id(id))
     
     if MULTI_CLIENT:
         logging.info(f"Client {index} is now serving {request.remote}")
 
-    if faster_client in class_cache:
-        tg_connect = class_cache[faster_client]
-        logging.debug(f"Using cached ByteStreamer object for client {index}")
+    tg_connect = get_streamer(index)
+    if file_id is None:
+        logging.debug("before calling get_file_properties")
+        file_id = await tg_connect.get_file_properties(id)
+        logging.debug("after calling get_file_properties")
+
+        if file_id.unique_id[:6] != secure_hash:
+            logging.debug(f"Invalid hash for message with ID {id}")
+            raise InvalidHash
+        signed = False
     else:
-        logging.debug(f"Creating new ByteStreamer object for client {index}")
-        tg_connect = ByteStreamer(faster_client)
-        class_cache[faster_client] = tg_connect
-    logging.debug("before calling get_file_properties")
-    file_id = await tg_connect.get_file_properties(id)
-    logging.debug("after calling get_file_properties")
-    
-    if file_id.unique_id[:6] != secure_hash:
-        logging.debug(f"Invalid hash for message with ID {id}")
-        raise InvalidHash
+        signed = True
     
     file_size = file_id.file_size
-
-    if range_header:
-        from_bytes, until_bytes = range_header.replace("bytes=", "").split("-")
-        from_bytes = int(from_bytes)
-        until_bytes = int(until_bytes) if until_bytes else file_size - 1
-    else:
-        from_bytes = request.http_range.start or 0
-        until_bytes = (request.http_range.stop or file_size) - 1
-
-    if (until_bytes > file_size) or (from_bytes < 0) or (until_bytes < from_bytes):
-        return web.Response(
-            status=416,
-            body="416: Range not satisfiable",
-            headers={"Content-Range": f"bytes */{file_size}"},
-        )
-
-    chunk_size = 1024 * 1024
-    until_bytes = min(until_bytes, file_size - 1)
-
-    offset = from_bytes - (from_bytes % chunk_size)
-    first_part_cut = from_bytes - offset
-    last_part_cut = until_bytes % chunk_size + 1
-
-    req_length = until_bytes - from_bytes + 1
-    part_count = math.ceil(until_bytes / chunk_size) - math.floor(offset / chunk_size)
-    body = tg_connect.yield_file(
-        file_id, index, offset, first_part_cut, last_part_cut, part_count, chunk_size
-    )
-
     mime_type = file_id.mime_type
     file_name = file_id.file_name
     disposition = "attachment"
@@ -132,22 +218,132 @@ async def media_streamer(request: web.Request, id: int, secure_hash: str):
                 file_name = f"{secrets.token_hex(2)}.unknown"
     else:
         if file_name:
-            mime_type = mimetypes.guess_type(file_id.file_name)
+            mime_type = mimetypes.guess_type(file_id.file_name)[0] or "application/octet-stream"
         else:
             mime_type = "application/octet-stream"
             file_name = f"{secrets.token_hex(2)}.unknown"
 
-    return web.Response(
-        status=206 if range_header else 200,
-        body=body,
-        headers={
-            "Content-Type": f"{mime_type}",
-            "Content-Range": f"bytes {from_bytes}-{until_bytes}/{file_size}",
-            "Content-Length": str(req_length),
-            "Content-Disposition": f'{disposition}; filename="{file_name}"',
-            "Accept-Ranges": "bytes",
-        },
-    )
+    etag = f'"{file_id.unique_id}"'
+    last_modified = getattr(file_id, "date", 0)
+    max_age = STREAM_CACHE_MAX_AGE
+    expires = getattr(file_id, "expires", 0)
+    if expires:
+        max_age = max(min(max_age, int(expires - time.time())), 0)
+    cache_headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={max_age}, immutable",
+    }
+    if last_modified:
+        cache_headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+
+    if not_modified(request, etag, last_modified):
+        return web.Response(status=304, headers=cache_headers)
+
+    if range_header and not if_range_matches(request, etag, last_modified):
+        range_header = 0
+
+    if range_header:
+        byte_range = parse_range(range_header, file_size)
+        if byte_range is None:
+            return web.Response(
+                status=416,
+                body="416: Range not satisfiable",
+                headers={"Content-Range": f"bytes */{file_size}"},
+            )
+        from_bytes, until_bytes = byte_range
+    else:
+        from_bytes, until_bytes = 0, file_size - 1
+
+    req_length = until_bytes - from_bytes + 1
+    headers = {
+        "Content-Type": f"{mime_type}",
+        "Content-Length": str(req_length),
+        "Content-Disposition": f'{disposition}; filename="{file_name}"',
+        "Accept-Ranges": "bytes",
+        **cache_headers,
+    }
+    if range_header:
+        headers["Content-Range"] = f"bytes {from_bytes}-{until_bytes}/{file_size}"
+    status = 206 if range_header else 200
+
+    if request.method == "HEAD":
+        return web.Response(status=status, headers=headers)
+
+    user_id = getattr(file_id, "user_id", 0)
+    if user_id:
+        flow = fair_share.get_flow(f"user:{user_id}", await get_user_tier_name(user_id))
+    else:
+        # Users behind one NAT or proxy share an IP, so links without a user aren't capped by default.
+        flow = fair_share.get_flow(f"ip:{request.remote}", "free", STREAM_MAX_PER_IP)
+    if not fair_share.try_open(flow):
+        return web.Response(
+            status=429,
+            text="429: Too many streams open, close one and try again",
+            headers={"Retry-After": "10"},
+        )
+
+    try:
+        stream_id = file_id
+        if signed and index != 0:
+            # The access hash and file reference of a signed token belong to the main bot, which made
+            # the log channel copy. Other clients resolve the message themselves, only once the body
+            # is needed, so 304, HEAD and 416 are answered from the token alone.
+            stream_id = await tg_connect.get_file_properties(file_id.message_id)
+        body = tg_connect.yield_file(stream_id, index, from_bytes, until_bytes, flow)
+        return await send_stream(request, web.StreamResponse(status=status, headers=headers), body, index, started)
+    finally:
+        fair_share.stream_finished(flow)
+
+def parse_range(range_header: str, file_size: int):
+    """
+    Returns the (from_bytes, until_bytes) of the first range in a Range header,
+    or None if it can't be satisfied.
+    """
+    try:
+        start, end = range_header.replace("bytes=", "").split(",")[0].strip().split("-")
+        if start:
+            from_bytes = int(start)
+            until_bytes = min(int(end), file_size - 1) if end else file_size - 1
+        else:
+            from_bytes = max(file_size - int(end), 0)
+            until_bytes = file_size - 1
+    except ValueError:
+        return None
+    if from_bytes < 0 or from_bytes >= file_size or until_bytes < from_bytes:
+        return None
+    return from_bytes, until_bytes
+
+def etag_matches(header: str, etag: str) -> bool:
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+def header_date(request: web.Request, name: str):
+    value = request.headers.get(name)
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+def not_modified(request: web.Request, etag: str, last_modified: int) -> bool:
+    """Checks If-None-Match, or If-Modified-Since when there is no If-None-Match."""
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        return etag_matches(if_none_match, etag)
+    since = header_date(request, "If-Modified-Since")
+    return bool(last_modified and since and last_modified <= since)
+
+def if_range_matches(request: web.Request, etag: str, last_modified: int) -> bool:
+    """Checks If-Range, a failed check means the whole file must be sent instead of the range."""
+    if_range = request.headers.get("If-Range")
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        # If-Range only allows a strong comparison.
+        return if_range.strip() == etag
+    since = header_date(request, "If-Range")
+    return bool(last_modified and since and last_modified == int(since))
 
 def setup_routes(app):
     # Add regular routes
@@ -0,0 +1,11 @@
+import os
+
+# info.py reads these at import, the tests don't talk to telegram or a database.
+for key, value in {
+    "API_ID": "1",
+    "API_HASH": "test",
+    "BOT_TOKEN": "1:test",
+    "LOG_CHANNEL": "-1001",
+    "DATABASE_URI": "mongodb://127.0.0.1:27017",
+}.items():
+    os.environ.setdefault(key, value)
@@ -0,0 +1,31 @@
+import asyncio
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+from main.server.exceptions import FIleNotFound
+from plugins import route
+
+
+class RecordingLogCopies:
+    def __init__(self):
+        self.forgotten = []
+
+    async def forget_message(self, msg_id):
+        self.forgotten.append(msg_id)
+
+
+async def missing_message(request, id, secure_hash, file_id=None):
+    raise FIleNotFound
+
+
+@pytest.mark.parametrize("path", ["123/video.mkv?hash=abcdef", "abcdef123"])
+def test_legacy_link_to_deleted_message_forgets_the_copy(monkeypatch, path):
+    log_copies = RecordingLogCopies()
+    monkeypatch.setattr(route, "log_copies", log_copies)
+    monkeypatch.setattr(route, "media_streamer", missing_message)
+    request = make_mocked_request("GET", f"/{path}", match_info={"path": path.split("?")[0]})
+
+    with pytest.raises(web.HTTPNotFound):
+        asyncio.run(route.stream_handler(request))
+
+    assert log_copies.forgotten == [123]